@@ -0,0 +1,357 @@
+import asyncio
+import asyncssh
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+# opens a bunch of fake users against a running termegle and writes the numbers out as json.
+# start the server with a high --connections-per-minute first or the rate limiter eats most of them
+
+INTERESTS = ["gaming", "sports", "pb and j", "music", "anime", "cats", "coding", "movies"]
+TOKEN = re.compile(r"stranger: hi (lt\d+x\d+)")
+
+def percentiles(samples):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    def pick(p):
+        return round(samples[min(len(samples) - 1, int(p / 100 * len(samples)))] * 1000, 2)
+    return {"count": len(samples), "p50_ms": pick(50), "p90_ms": pick(90), "p99_ms": pick(99), "max_ms": round(samples[-1] * 1000, 2)}
+
+def read_proc(pid):
+    #cpu seconds and rss (kb) of a server process, linux only
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        with open(f"/proc/{pid}/status") as f:
+            rss = next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+        return cpu, rss
+    except (OSError, StopIteration, IndexError, ValueError):
+        return None
+
+class LoadTest:
+    def __init__(self, options, first_uid=0):
+        self.options = options
+        self.first_uid = first_uid
+        self.sent = {}
+        self.connect_latency = []
+        self.match_latency = []
+        self.message_latency = []
+        self.messages_sent = 0
+        # every chat line that showed up, including ones sent from another load test process
+        self.messages_received = 0
+        self.bytes_received = 0
+        self.commands = {"next": 0, "save": 0}
+        self.errors = {}
+
+    def error(self, e):
+        name = type(e).__name__
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+    async def user(self, uid, idle, deadline):
+        options = self.options
+        started = time.monotonic()
+        try:
+            conn = await asyncssh.connect(options.host, options.port, known_hosts=None, username=f"loadtest{uid}")
+        except Exception as e:
+            self.error(e)
+            return
+
+        async with conn:
+            proc = await conn.create_process(term_type="xterm", term_size=(80, 40))
+            matched = asyncio.Event()
+            prompted = asyncio.Event()
+
+            async def reader():
+                while True:
+                    data = await proc.stdout.read(65536)
+                    if not data:
+                        break
+                    now = time.monotonic()
+                    self.bytes_received += len(data.encode())
+                    if not prompted.is_set() and "what are your interests?" in data:
+                        self.connect_latency.append(now - started)
+                        prompted.set()
+                    if "connected to a stranger!" in data:
+                        matched.set()
+                    for token in TOKEN.findall(data):
+                        self.messages_received += 1
+                        sent_at = self.sent.pop(token, None)
+                        if sent_at is not None:
+                            self.message_latency.append(now - sent_at)
+
+            read_task = asyncio.create_task(reader())
+            try:
+                await asyncio.wait_for(prompted.wait(), options.timeout)
+                asked = time.monotonic()
+                proc.stdin.write(", ".join(random.sample(INTERESTS, random.randint(0, 3))) + "\r")
+                await asyncio.wait_for(matched.wait(), options.timeout)
+                self.match_latency.append(time.monotonic() - asked)
+
+                seq = 0
+                while time.monotonic() < deadline:
+                    await asyncio.sleep(random.expovariate(options.rate))
+                    if idle:
+                        continue
+                    roll = random.random()
+                    if roll < options.next_chance:
+                        proc.stdin.write("next\r")
+                        self.commands["next"] += 1
+                    elif roll < options.next_chance + options.save_chance:
+                        proc.stdin.write("save\r")
+                        await asyncio.sleep(0.5)
+                        proc.stdin.write("back\r")
+                        self.commands["save"] += 1
+                    else:
+                        token = f"lt{uid}x{seq}"
+                        seq += 1
+                        self.sent[token] = time.monotonic()
+                        self.messages_sent += 1
+                        proc.stdin.write(f"hi {token}\r")
+            except Exception as e:
+                self.error(e)
+            finally:
+                read_task.cancel()
+                proc.close()
+
+    async def run(self):
+        options = self.options
+        before = {pid: read_proc(pid) for pid in options.server_pid}
+        started = time.monotonic()
+        deadline = started + options.ramp + options.duration
+
+        users = []
+        for uid in range(self.first_uid, self.first_uid + options.users):
+            idle = random.random() < options.idle_fraction
+            users.append(asyncio.create_task(self.user(uid, idle, deadline)))
+            await asyncio.sleep(options.ramp / max(1, options.users))
+        await asyncio.gather(*users)
+
+        after = {pid: read_proc(pid) for pid in options.server_pid}
+        server = {}
+        for pid in options.server_pid:
+            if before[pid] and after[pid]:
+                server[pid] = {"cpu_seconds": round(after[pid][0] - before[pid][0], 3), "rss_kb": after[pid][1]}
+
+        return {
+            "started": datetime.now().isoformat(),
+            "config": vars(options),
+            "wall_seconds": round(time.monotonic() - started, 3),
+            "connect_latency": percentiles(self.connect_latency),
+            "time_to_match": percentiles(self.match_latency),
+            "message_latency": percentiles(self.message_latency),
+            "messages_sent": self.messages_sent,
+            "messages_received": self.messages_received,
+            "messages_undelivered": len(self.sent),
+            "commands": self.commands,
+            "bytes_received": self.bytes_received,
+            "bytes_per_message": round(self.bytes_received / self.messages_sent, 1) if self.messages_sent else None,
+            "server": server,
+            "errors": self.errors,
+        }
+
+# what --handshake compares when no --kex/--cipher/--host-key-alg are given
+HANDSHAKE_KEX = ["curve25519-sha256", "ecdh-sha2-nistp256", "diffie-hellman-group14-sha256"]
+HANDSHAKE_CIPHERS = ["aes128-gcm@openssh.com", "chacha20-poly1305@openssh.com", "aes256-ctr"]
+HANDSHAKE_HOST_KEY_ALGS = ["ssh-ed25519", "rsa-sha2-256"]
+
+class HandshakeTest:
+    # just connects and hangs up, once per kex/cipher/host key combination, to see what each costs
+    def __init__(self, options):
+        self.options = options
+
+    async def handshake(self, algs, samples, errors):
+        started = time.monotonic()
+        try:
+            conn = await asyncssh.connect(self.options.host, self.options.port, known_hosts=None, username="handshake", **algs)
+        except Exception as e:
+            name = type(e).__name__
+            errors[name] = errors.get(name, 0) + 1
+            return
+        samples.append(time.monotonic() - started)
+        conn.close()
+
+    async def combination(self, kex, cipher, host_key_alg):
+        options = self.options
+        algs = {"kex_algs": [kex], "encryption_algs": [cipher], "server_host_key_algs": [host_key_alg]}
+        samples, errors = [], {}
+        gate = asyncio.Semaphore(options.concurrency)
+
+        async def one():
+            async with gate:
+                await self.handshake(algs, samples, errors)
+
+        before = {pid: read_proc(pid) for pid in options.server_pid}
+        started = time.monotonic()
+        await asyncio.gather(*(one() for _ in range(options.handshakes)))
+        wall = time.monotonic() - started
+        after = {pid: read_proc(pid) for pid in options.server_pid}
+
+        server_cpu = sum(after[pid][0] - before[pid][0] for pid in options.server_pid if before[pid] and after[pid])
+        result = {
+            "kex": kex,
+            "cipher": cipher,
+            "host_key_alg": host_key_alg,
+            "handshakes_per_second": round(len(samples) / wall, 1),
+            "latency": percentiles(samples),
+            "server_cpu_ms_per_handshake": round(server_cpu * 1000 / len(samples), 3) if samples and options.server_pid else None,
+            "errors": errors,
+        }
+        print(f"{kex:32} {cipher:32} {host_key_alg:14} {result['handshakes_per_second']:8} /s")
+        return result
+
+    async def run(self):
+        options = self.options
+        results = []
+        for kex, cipher, host_key_alg in itertools.product(options.kex or HANDSHAKE_KEX,
+                                                          options.cipher or HANDSHAKE_CIPHERS,
+                                                          options.host_key_alg or HANDSHAKE_HOST_KEY_ALGS):
+            results.append(await self.combination(kex, cipher, host_key_alg))
+        return {
+            "started": datetime.now().isoformat(),
+            "config": vars(options),
+            "handshakes": results,
+        }
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "termegle_server.py")
+
+def server_pids(pid):
+    #the server plus its broker and workers, linux only
+    pids = [pid]
+    try:
+        for entry in os.listdir("/proc"):
+            if entry.isdigit():
+                with open(f"/proc/{entry}/stat") as f:
+                    if int(f.read().rsplit(")", 1)[1].split()[1]) == pid:
+                        pids.append(int(entry))
+    except OSError:
+        pass
+    return pids
+
+def load_share(options, first_uid):
+    random.seed(first_uid)
+    return asyncio.run(LoadTest(options, first_uid).run())
+
+class ScalingTest:
+    # starts the server with each --workers count in turn and throws the same load at it. chat lines
+    # delivered per second is what should go up with the worker count, as long as the machine has the
+    # cores for it and the load test itself (spread over --client-procs processes) isn't what runs out
+    def __init__(self, options):
+        self.options = options
+
+    def start_server(self, workers, key_path):
+        options = self.options
+        proc = subprocess.Popen([sys.executable, SERVER, "--host", options.host, "--port", str(options.port),
+                                 "--workers", str(workers), "--metrics-port", "0", "--connections-per-minute", "1000000",
+                                 "--log-level", "WARNING", "--host-key", key_path],
+                                stdout=subprocess.DEVNULL)
+        deadline = time.monotonic() + 30
+        while True:
+            if proc.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError(f"server with {workers} workers didn't come up")
+            try:
+                socket.create_connection((options.host, options.port), timeout=1).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        time.sleep(1)  #the other workers bind a moment after the first one
+        return proc
+
+    def run(self):
+        options = self.options
+        procs = options.client_procs
+        share = argparse.Namespace(**vars(options))
+        share.users = options.users // procs
+        share.server_pid = []
+        results = []
+        with tempfile.TemporaryDirectory() as tmp:
+            for workers in options.scaling:
+                server = self.start_server(workers, os.path.join(tmp, "host_key"))
+                try:
+                    pids = server_pids(server.pid)
+                    before = {pid: read_proc(pid) for pid in pids}
+                    started = time.monotonic()
+                    with multiprocessing.Pool(procs) as pool:
+                        runs = pool.starmap(load_share, [(share, n * share.users) for n in range(procs)])
+                    wall = time.monotonic() - started
+                    after = {pid: read_proc(pid) for pid in pids}
+                finally:
+                    server.terminate()
+                    server.wait()
+
+                received = sum(run["messages_received"] for run in runs)
+                errors = {}
+                for run in runs:
+                    for name, count in run["errors"].items():
+                        errors[name] = errors.get(name, 0) + count
+                result = {
+                    "workers": workers,
+                    "messages_sent": sum(run["messages_sent"] for run in runs),
+                    "messages_received": received,
+                    #over the ramp and chatting time, a straggler timing out afterwards doesn't count against it
+                    "messages_per_second": round(received / (options.ramp + options.duration), 1),
+                    "wall_seconds": round(wall, 3),
+                    "server_cpu_seconds": round(sum(after[pid][0] - before[pid][0] for pid in pids if before[pid] and after[pid]), 3),
+                    "time_to_match": [run["time_to_match"] for run in runs],
+                    "message_latency": [run["message_latency"] for run in runs],
+                    "errors": errors,
+                }
+                print(f"{workers:3} workers: {result['messages_per_second']:10} messages/s delivered, "
+                      f"server cpu {result['server_cpu_seconds']}s")
+                results.append(result)
+        return {
+            "started": datetime.now().isoformat(),
+            "config": vars(options),
+            "cpus": os.cpu_count(),
+            "runs": results,
+        }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="load test a running termegle server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6767)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--ramp", type=float, default=10, help="seconds to spread the connects over")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to keep chatting after the ramp")
+    parser.add_argument("--rate", type=float, default=0.5, help="actions per second per user")
+    parser.add_argument("--next-chance", type=float, default=0.05)
+    parser.add_argument("--save-chance", type=float, default=0.02)
+    parser.add_argument("--idle-fraction", type=float, default=0.2, help="users that connect, get matched and never type")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--server-pid", type=int, action="append", default=[], help="server (or worker) pid to read cpu/rss from, repeatable")
+    parser.add_argument("--out", default="loadtest.json")
+    parser.add_argument("--handshake", action="store_true", help="only benchmark connection setup, across kex/cipher/host key choices")
+    parser.add_argument("--handshakes", type=int, default=200, help="connections per combination in --handshake mode")
+    parser.add_argument("--concurrency", type=int, default=20, help="handshakes in flight at once in --handshake mode")
+    parser.add_argument("--kex", action="append", help="key exchange to try in --handshake mode, repeatable")
+    parser.add_argument("--cipher", action="append", help="cipher to try in --handshake mode, repeatable")
+    parser.add_argument("--host-key-alg", action="append", help="host key algorithm to try in --handshake mode, repeatable")
+    parser.add_argument("--scaling", type=lambda text: [int(n) for n in text.split(",")],
+                        help="comma separated worker counts, e.g. 1,2,4: starts the server on --port with each one and runs the same load against it")
+    parser.add_argument("--client-procs", type=int, default=os.cpu_count() or 1, help="processes the users are split across in --scaling mode")
+    options = parser.parse_args(argv)
+
+    if options.scaling:
+        results = ScalingTest(options).run()
+    elif options.handshake:
+        results = asyncio.run(HandshakeTest(options).run())
+    else:
+        results = asyncio.run(LoadTest(options).run())
+    with open(options.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+    return results
+
+if __name__ == '__main__':
+    main()
@@ -1,113 +1,797 @@
 import asyncio
 import asyncssh
 from datetime import datetime
-from collections import defaultdict
+from collections import defaultdict, deque, OrderedDict
 import random
+import heapq
+import time
+import ipaddress
+import json
+import os
+import argparse
+import tempfile
+import multiprocessing
+import bisect
+import logging
+import logging.handlers
+import queue
+import secrets
+import signal
+import socket
+import sys
+import base64
+import itertools
+import math
+import re
+import unicodedata
+
+log = logging.getLogger("termegle")
+log_listener = None
+
+def setup_logging(level="INFO"):
+    # handlers run on a listener thread, so a slow stdout never blocks the event loop
+    global log_listener
+    records = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("[%(asctime)s] %(levelname)s %(processName)s: %(message)s"))
+    listener = logging.handlers.QueueListener(records, handler)
+    listener.start()
+    #a forked worker inherits the parent's listener, but not the thread running it
+    log_listener = listener
+    root = logging.getLogger()
+    root.handlers = [logging.handlers.QueueHandler(records)]
+    root.setLevel(level.upper())
+    logging.getLogger("asyncssh").setLevel(logging.WARNING)
+    return listener
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.kind = "counter"
+        self.values = defaultdict(float)
+
+    def inc(self, amount=1, **labels):
+        self.values[tuple(sorted(labels.items()))] += amount
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield self.name, labels, value
+
+class Gauge:
+    # read when scraped instead of being kept up to date on the hot path
+    def __init__(self, name, help, read):
+        self.name = name
+        self.help = help
+        self.kind = "gauge"
+        self.read = read
+
+    def samples(self):
+        yield self.name, (), self.read()
+
+class Histogram:
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.kind = "histogram"
+        self.buckets = buckets
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        counts = self.values.get(key)
+        if counts is None:
+            counts = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        counts[0][bisect.bisect_left(self.buckets, value)] += 1
+        counts[1] += value
+
+    def samples(self):
+        for labels, (counts, total) in self.values.items():
+            seen = 0
+            for bound, count in zip(self.buckets + [float("inf")], counts):
+                seen += count
+                yield self.name + "_bucket", labels + (("le", "+Inf" if bound == float("inf") else repr(bound)),), seen
+            yield self.name + "_sum", labels, total
+            yield self.name + "_count", labels, seen
+
+SCRAPE_TIMEOUT = 5
+
+class Metrics:
+    def __init__(self):
+        self.all = []
+        self.server = None
+        self.connections = self.add(Counter("termegle_connections_total", "ssh connections accepted"))
+        self.rate_limited = self.add(Counter("termegle_rate_limited_total", "connections or chat lines rejected by a rate limit"))
+        self.messages = self.add(Counter("termegle_messages_total", "chat lines relayed"))
+        self.matches = self.add(Counter("termegle_matches_total", "pairings made, by priority tier"))
+        self.match_wait = self.add(Histogram("termegle_match_wait_seconds", "how long the waiting user sat in the queue, by priority tier",
+                                             [0.1, 0.5, 1, 5, 15, 30, 60, 120, 300]))
+        self.render_seconds = self.add(Histogram("termegle_render_seconds", "time spent building a screen update",
+                                                 [0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.01]))
+        self.render_bytes = self.add(Histogram("termegle_render_bytes", "size of a screen update",
+                                               [64, 256, 1024, 4096, 16384]))
+        self.frames_dropped = self.add(Counter("termegle_frames_dropped_total", "renders collapsed or skipped for slow clients"))
+        self.overflows = self.add(Counter("termegle_output_overflows_total", "sessions cut off for not reading their output"))
+        self.idle = self.add(Counter("termegle_idle_total", "idle warnings and kicks"))
+        self.resume = self.add(Counter("termegle_resume_total", "dropped sessions parked, resumed or expired"))
+
+    def add(self, metric):
+        self.all.append(metric)
+        return metric
+
+    def gauge(self, name, help, read):
+        return self.add(Gauge(name, help, read))
+
+    def exposition(self):
+        out = []
+        for metric in self.all:
+            out.append(f"# HELP {metric.name} {metric.help}\n# TYPE {metric.name} {metric.kind}\n")
+            for name, labels, value in metric.samples():
+                if labels:
+                    name += "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+                out.append(f"{name} {value}\n")
+        return "".join(out)
+
+    async def read_request(self, reader):
+        request = await reader.readline()
+        while (await reader.readline()).strip():
+            pass
+        return request
+
+    async def handle_scrape(self, reader, writer):
+        try:
+            #a client that never finishes its headers would hold the connection open forever
+            request = await asyncio.wait_for(self.read_request(reader), SCRAPE_TIMEOUT)
+            if request.split()[1:2] == [b"/metrics"]:
+                status, body = "200 OK", self.exposition().encode()
+            else:
+                status, body = "404 Not Found", b"try /metrics\n"
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except Exception as e:
+            log.debug("bad metrics request: %s", e)
+        finally:
+            writer.close()
+
+    async def serve(self, port, sock=None):
+        #sock is the listener handed over by the process we're replacing
+        if sock is not None:
+            self.server = await asyncio.start_server(self.handle_scrape, sock=sock)
+        else:
+            self.server = await asyncio.start_server(self.handle_scrape, "127.0.0.1", port)
+        log.info("metrics on http://127.0.0.1:%d/metrics", port)
+
+metrics = Metrics()
+metrics.gauge("termegle_active_users", "users connected to this process", lambda: len(matchmaker.active_users))
+metrics.gauge("termegle_online_users", "users online across every worker, as last counted", lambda: presence.total or 0)
+metrics.gauge("termegle_waiting_users", "users in the matchmaking queue", lambda: len(getattr(matchmaker, "waiting", ())))
+metrics.gauge("termegle_parked_sessions", "dropped sessions waiting to be resumed", lambda: len(resume_cache.parked))
+
+class TokenBucket:
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, tokens, now):
+        self.tokens = tokens
+        self.updated = now
+
+    def take(self, now, rate, capacity):
+        self.tokens = min(capacity, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
 
 class RateLimiter:
-    def __init__(self):
-        self.connections = defaultdict(list)
+    def __init__(self, limit=5, period=60, max_keys=100_000, ipv4_prefix=32, ipv6_prefix=64, clock=time.monotonic):
+        # token bucket per address (or per /24, /64 etc): `limit` connections, refilled over `period` seconds
+        self.limit = limit
+        self.rate = limit / period
+        self.period = period
+        self.max_keys = max_keys
+        self.ipv4_prefix = ipv4_prefix
+        self.ipv6_prefix = ipv6_prefix
+        self.clock = clock
+        # least recently seen first, so idle keys get evicted from the front
+        self.connections = OrderedDict()
+
+    def key_for(self, ip):
+        if self.ipv4_prefix >= 32 and ':' not in ip:
+            return ip  #plain ipv4 (or 'unknown'), nothing to aggregate and parsing is the slow part
+        try:
+            addr = ipaddress.ip_address(ip)
+        except ValueError:
+            return ip
+        if addr.version == 6 and addr.ipv4_mapped:
+            addr = addr.ipv4_mapped
+        prefix = self.ipv4_prefix if addr.version == 4 else self.ipv6_prefix
+        return (addr.version, int(addr) >> (addr.max_prefixlen - prefix))
 
     def check_rate_limit(self, ip):
-        now = datetime.now()
-        self.connections[ip] = [
-            time for time in self.connections[ip]
-            if (now - time).total_seconds() < 60
-        ]
-        if len(self.connections[ip]) >= 5:
-            return False
-        self.connections[ip].append(now)
-        return True
+        now = self.clock()
+        key = self.key_for(ip)
+
+        # a bucket that's been idle a whole period is full again, same as not having one.
+        # a full table only makes room for keys it doesn't have yet
+        while self.connections:
+            oldest = next(iter(self.connections.values()))
+            if now - oldest.updated < self.period and (len(self.connections) < self.max_keys or key in self.connections):
+                break
+            self.connections.popitem(last=False)
+
+        bucket = self.connections.get(key)
+        if bucket is None:
+            bucket = self.connections[key] = TokenBucket(self.limit, now)
+        else:
+            self.connections.move_to_end(key)
+        return bucket.take(now, self.rate, self.limit)
+
+    def snapshot(self):
+        # monotonic time is system wide on linux, so the timestamps still mean something in the next process
+        return [[key if isinstance(key, str) else list(key), bucket.tokens, bucket.updated] for key, bucket in self.connections.items()]
+
+    def restore(self, entries):
+        for key, tokens, updated in entries:
+            bucket = TokenBucket(tokens, updated)
+            self.connections[key if isinstance(key, str) else tuple(key)] = bucket
 
 rate_limiter = RateLimiter()
 
+MESSAGE_RATE = 2
+MESSAGE_BURST = 8
+
+# how long (seconds) someone with interests holds out for a common-interest match before taking anyone
+MATCH_PATIENCE = 5
+# what a second of waiting is worth next to one shared tag when ranking candidates
+MATCH_WAIT_WEIGHT = 0.05
+# anyone who's waited this long (seconds) gets the next person through the door, interests or not
+MATCH_SLO = 30
+# how often waiters hear their place in line
+QUEUE_STATUS_INTERVAL = 2
+# oldest waiters looked at per tag when ranking, so a popular tag doesn't turn into a queue scan
+MATCH_CANDIDATES = 32
+MAX_INTERESTS = 10
+MAX_TAG_LENGTH = 40
+MAX_TAGS = 100_000
+
+# squashed (no spaces) spelling, as typed or stemmed -> the tag it means
+TAG_ALIASES = {
+    "videogame": "gaming", "game": "gaming", "gamer": "gaming",
+    "code": "coding", "programming": "coding", "programmer": "coding", "dev": "coding",
+    "movie": "movies", "film": "movies", "cinema": "movies",
+    "tv": "tv shows", "tvshow": "tv shows", "show": "tv shows", "series": "tv shows", "tvseries": "tv shows",
+    "book": "reading", "read": "reading",
+    "cat": "cats", "kitty": "cats", "kitten": "cats",
+    "dog": "dogs", "puppy": "dogs",
+    "sport": "sports",
+    "pbandj": "pb and j", "pbj": "pb and j", "pbnj": "pb and j",
+}
+
+def stem(word):
+    #just enough to line up plurals, "cats"/"cat" and "hobbies"/"hobby"
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+class TagIndex:
+    # interest text -> small int ids, so "video games", "videogames" and "gaming" are one tag
+    # and the matchmaker only ever compares ints
+    def __init__(self, max_tags=MAX_TAGS):
+        self.max_tags = max_tags
+        self.ids = {}
+        self.names = []
+        # joins that used each tag, for idf
+        self.joins = []
+        self.total_joins = 0
+
+    def intern(self, text):
+        words = "".join(c if c.isalnum() else " " for c in text.lower()).split()
+        if not words:
+            return None
+        stemmed = " ".join(stem(word) for word in words)
+        alias = TAG_ALIASES.get("".join(words)) or TAG_ALIASES.get(stemmed.replace(" ", ""))
+        key = (alias or stemmed)[:MAX_TAG_LENGTH]
+        tag = self.ids.get(key)
+        if tag is None:
+            if len(self.names) >= self.max_tags:
+                return None  #full, a brand new tag this late just doesn't count for matching
+            tag = self.ids[key] = len(self.names)
+            #shown as whatever the first person typed, unless it's an alias
+            self.names.append(alias or " ".join(words)[:MAX_TAG_LENGTH])
+            self.joins.append(0)
+        return tag
+
+    def tags(self, interests):
+        found = set()
+        for text in interests:
+            tag = self.intern(text)
+            if tag is not None:
+                found.add(tag)
+                if len(found) == MAX_INTERESTS:
+                    break
+        for tag in found:
+            self.joins[tag] += 1
+        self.total_joins += 1
+        return frozenset(found)
+
+    def weight(self, tag):
+        # idf, sharing a rare tag says a lot more than both liking "music"
+        return math.log((1 + self.total_joins) / (1 + self.joins[tag])) + 1
+
+    def describe(self, tags):
+        return {self.names[tag] for tag in tags}
+
 class Matchmaker:
-    def __init__(self):
-        self.waiting = {}
+    def __init__(self, patience=MATCH_PATIENCE, slo=MATCH_SLO):
+        self.tags = TagIndex()
+        self.patience = patience
+        self.slo = slo
+        # session -> (tags, join_time, from_next), kept in join order so the first key is the oldest waiter
+        self.waiting = OrderedDict()
+        # same order, but only people who didn't click "next" (priority 1 skips those)
+        self.fifo = OrderedDict()
+        # people who'll take anyone: no interests, clicked "next", or ran out of patience
+        self.willing = OrderedDict()
+        # tag id -> waiting sessions with that tag, also in join order
+        self.by_interest = defaultdict(OrderedDict)
+        self.join_seq = {}
+        self.next_seq = 0
+        # last (position, estimate) each waiter was told, and a running average of how long matched waiters waited
+        self.statuses = {}
+        self.avg_wait = None
         self.active_users = set()
-
-    async def find_match(self, session, interests, from_next=False):
-        if session in self.waiting:
-            del self.waiting[session]
+        # everything below is only touched by run(), one event at a time, so nobody gets matched twice
+        self.partners = {}
+        self.profiles = {}
+        # sessions whose connection dropped, parked in the resume cache and kept out of the queue
+        self.away = set()
+        self.events = asyncio.Queue()
+        self.task = None
+
+    def enqueue(self, session, tags, from_next=False):
+        self.dequeue(session)
+        self.waiting[session] = (tags, time.monotonic(), from_next)
+        self.join_seq[session] = self.next_seq
+        self.next_seq += 1
+        if not from_next:
+            self.fifo[session] = None
+        if from_next or not tags or not self.patience:
+            self.willing[session] = None
+        for tag in tags:
+            self.by_interest[tag][session] = None
+
+    def dequeue(self, session):
+        entry = self.waiting.pop(session, None)
+        if entry is None:
+            return None
+        self.fifo.pop(session, None)
+        self.willing.pop(session, None)
+        self.statuses.pop(session, None)
+        del self.join_seq[session]
+        for tag in entry[0]:
+            bucket = self.by_interest[tag]
+            bucket.pop(session, None)
+            if not bucket:
+                del self.by_interest[tag]
+        return entry
+
+    def best_common(self, tags):
+        # ranks the oldest few waiters of each of our tags by idf weighted overlap plus time waited,
+        # so this is O(tags * MATCH_CANDIDATES) however long the queue is
+        scores = {}
+        for tag in tags:
+            bucket = self.by_interest.get(tag)
+            if not bucket:
+                continue
+            weight = self.tags.weight(tag)
+            for candidate in itertools.islice(bucket, MATCH_CANDIDATES):
+                scores[candidate] = scores.get(candidate, 0) + weight
+        if not scores:
+            return None
+        now = time.monotonic()
+        return max(scores, key=lambda candidate: scores[candidate] + MATCH_WAIT_WEIGHT * (now - self.waiting[candidate][1]))
+
+    def take(self, partner, tier):
+        partner_tags, join_time, _ = self.dequeue(partner)
+        waited = time.monotonic() - join_time
+        self.avg_wait = waited if self.avg_wait is None else 0.9 * self.avg_wait + 0.1 * waited
+        metrics.matches.inc(tier=tier)
+        metrics.match_wait.observe(waited, tier=tier)
+        return partner_tags
+
+    def find_match(self, session, tags, from_next=False):
+        self.dequeue(session)
+
+        # priority 0, whoever's been waiting past the slo gets this person no matter what,
+        # so nobody starves behind interest matches and "next" clickers
+        if self.waiting:
+            oldest_session = next(iter(self.waiting))
+            if time.monotonic() - self.waiting[oldest_session][1] >= self.slo:
+                common = tags & self.take(oldest_session, "overdue")
+                log.info("matched a user who waited past the slo! active: %d", len(self.active_users))
+                return oldest_session, self.tags.describe(common)
 
         # priority 1, if this person clicked "next", match them with anyone immediately
-        if from_next and len(self.waiting) > 0:
-            # find the first available person (fifo from regular waiting queue)
-            oldest_session = None
-            oldest_time = None
+        # (fifo from regular waiting queue, people who also clicked "next" get their own match)
+        if from_next and self.fifo:
+            oldest_session = next(iter(self.fifo))
+            common = tags & self.take(oldest_session, "next")
+            log.info("matched 'next' clicker with waiting user! active: %d", len(self.active_users))
+            return oldest_session, self.tags.describe(common)
+
+        # priority 2, the best common-interest match (rarer shared tags first, then who's waited longest)
+        best_match = self.best_common(tags)
+        if best_match:
+            best_common = tags & self.take(best_match, "interests")
+            log.info("matched two users with %d common interest(s)! active: %d", len(best_common), len(self.active_users))
+            return best_match, self.tags.describe(best_common)
+
+        # priority 3, match with the person who's been waiting the LONGEST (fifo),
+        # as long as neither of you is still holding out for common interests
+        if self.willing and (from_next or not tags or not self.patience):
+            oldest_session = next(iter(self.willing))
+            common = tags & self.take(oldest_session, "fifo")
+            log.info("matched two users (no common interests, FIFO)! active: %d", len(self.active_users))
+            return oldest_session, self.tags.describe(common)
 
-            for potential_partner, (partner_interests, join_time, partner_from_next) in list(self.waiting.items()):
-                if potential_partner is session:
-                    continue
-                # skip people who also clicked "next" they'll get their own match 
-                if partner_from_next:
-                    continue
-                if oldest_session is None or join_time < oldest_time:
-                    oldest_session = potential_partner
-                    oldest_time = join_time
-
-            if oldest_session:
-                partner_interests_set = self.waiting[oldest_session][0]
-                common = interests & partner_interests_set
-                del self.waiting[oldest_session]
-                print(f"[{datetime.now()}]  matched 'next' clicker with waiting user! active: {len(self.active_users)}")
-                return oldest_session, common, False
-        
-        # priority 2, try to find someone with common interests (prefer who joined first)
-        best_match = None
-        best_common = set()
-        earliest_time = None
-
-        for potential_partner, (partner_interests, join_time, partner_from_next) in list(self.waiting.items()):
-            if potential_partner is session:
-                continue
+        # no match found, add to waiting with current time and "from_next" flag
+        self.enqueue(session, tags, from_next)
+        log.debug("user waiting... (%d in queue, from_next=%s)", len(self.waiting), from_next)
+        return None, set()
 
-            common = interests & partner_interests
+    def add_user(self, session):
+        self.active_users.add(session)
 
-            if common:
-                #if we have common interests, prefer the person whos been waiting longest
-                if not best_match or join_time < earliest_time:
-                    best_match = potential_partner
-                    best_common = common
-                    earliest_time = join_time
+    # sessions only talk to the matchmaker through join/next/leave, which just queue an event for run().
+    # a match comes back through session.paired()
+    def join(self, session, interests, from_next=False):
+        self.post(("join", session, self.tags.tags(interests), from_next))
 
-        #if we found someone with common interests, match with them
-        if best_match:
-            del self.waiting[best_match]
-            print(f"[{datetime.now()}]  matched two users with {len(best_common)} common interest(s)! active: {len(self.active_users)}")
-            return best_match, best_common, False
-            
-        # priority 3, match with the person who's been waiting the LONGEST (fifo)
-        if len(self.waiting) > 0:
-            oldest_session = None
-            oldest_time = None
+    def next(self, session):
+        self.post(("next", session))
 
-            for potential_partner, (partner_interests, join_time, partner_from_next) in list(self.waiting.items()):
-                if potential_partner is session:
-                    continue
-                if oldest_session is None or join_time < oldest_time:
-                    oldest_session = potential_partner
-                    oldest_time = join_time
-            if oldest_session:
-                partner_interests_set = self.waiting[oldest_session][0]
-                common = interests & partner_interests_set
-                del self.waiting[oldest_session]
-                print(f"[{datetime.now()}]  matched two users (no common interests, FIFO)! active: {len(self.active_users)}")
-                return oldest_session, common, False
+    def leave(self, session, disconnect_reason=None):
+        self.post(("leave", session, disconnect_reason))
 
-        # no match found, add to waiting with current time and "from_next" flag
-        self.waiting[session] = (interests, datetime.now(), from_next)
-        print(f"[{datetime.now()}]  user waiting... ({len(self.waiting)} in queue, from_next={from_next})")
-        return None, set(), False
+    def park(self, session):
+        self.post(("park", session))
 
-    def remove(self, session):
-        if session in self.waiting:
-            del self.waiting[session]
-        if session in self.active_users:
-            self.active_users.remove(session)
+    def unpark(self, session):
+        self.post(("unpark", session))
+
+    def post(self, event):
+        self.events.put_nowait(event)
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+            asyncio.create_task(self.report_queue())
+
+    async def run(self):
+        while True:
+            self.handle(await self.events.get())
+
+    def drain(self):
+        # handles whatever is already queued right now, for when someone needs the settled state
+        while not self.events.empty():
+            self.handle(self.events.get_nowait())
+
+    def handle(self, event):
+        try:
+            if event[0] == "join":
+                self.on_join(*event[1:])
+            elif event[0] == "next":
+                self.on_next(*event[1:])
+            elif event[0] == "leave":
+                self.on_leave(*event[1:])
+            elif event[0] == "park":
+                self.on_park(*event[1:])
+            elif event[0] == "unpark":
+                self.on_unpark(*event[1:])
+            elif event[0] == "patience":
+                self.on_patience(*event[1:])
+        except Exception as e:
+            log.exception("error handling matchmaker %s: %s", event[0], e)
+
+    async def report_queue(self):
+        # a walk down the queue every couple of seconds, each waiter only hears about it when their line changes
+        while True:
+            await asyncio.sleep(QUEUE_STATUS_INTERVAL)
+            try:
+                now = time.monotonic()
+                for position, (session, (_, join_time, _)) in enumerate(self.waiting.items(), 1):
+                    estimate = None
+                    if self.avg_wait is not None:
+                        estimate = max(1, round(self.avg_wait * position - (now - join_time)))
+                    if self.statuses.get(session) != (position, estimate):
+                        self.statuses[session] = (position, estimate)
+                        session.queue_status(position, estimate)
+            except Exception as e:
+                log.exception("error reporting queue positions: %s", e)
+
+    def on_join(self, session, tags, from_next=False):
+        if session not in self.active_users or session in self.partners:
+            return
+        self.profiles[session] = tags
+        if session in self.away:
+            #dropped connection, stays out of the queue until it comes back
+            return
+
+        partner, common = self.find_match(session, tags, from_next)
+        if partner is not None:
+            self.pair(session, partner, common)
+        elif session not in self.willing:
+            #holding out for common interests, but not forever
+            asyncio.get_running_loop().call_later(self.patience, self.post, ("patience", session, self.join_seq[session]))
+
+    def pair(self, session, partner, common):
+        self.partners[session] = partner
+        self.partners[partner] = session
+        session.paired(partner, common, joined=True)
+        partner.paired(session, common)
+
+    def on_patience(self, session, seq):
+        if self.join_seq.get(session) != seq:
+            return  #matched, left or rejoined since
+        if not self.willing:
+            self.willing[session] = None
+            return
+        partner = next(iter(self.willing))
+        self.dequeue(session)
+        self.take(partner, "fifo")
+        log.info("matched two users (no common interests, gave up waiting)! active: %d", len(self.active_users))
+        self.pair(session, partner, set())
+
+    def on_next(self, session):
+        if session not in self.active_users:
+            return
+        old_partner = self.partners.pop(session, None)
+        if old_partner is not None:
+            del self.partners[old_partner]
+            old_partner.peer_left(session)
+            #usually a no-op since the clicker already reset, unless a match landed after they typed next
+            session.peer_left(old_partner)
+        #you get matched first, then the ex can find someone
+        self.on_join(session, self.profiles.get(session, set()), True)
+        if old_partner is not None:
+            self.on_join(old_partner, self.profiles.get(old_partner, set()))
+
+    def restore(self, session, interests, partner=None):
+        # a session carried over from the previous process, parked until its user reconnects
+        self.active_users.add(session)
+        self.profiles[session] = self.tags.tags(interests)
+        self.away.add(session)
+        if partner is not None:
+            self.partners[session] = partner
+
+    def on_park(self, session):
+        if session not in self.active_users:
+            return
+        self.away.add(session)
+        self.dequeue(session)
+
+    def on_unpark(self, session):
+        self.away.discard(session)
+        if session in self.active_users and session not in self.partners:
+            self.on_join(session, self.profiles.get(session, set()))
+
+    def on_leave(self, session, disconnect_reason=None):
+        self.dequeue(session)
+        self.away.discard(session)
+        self.active_users.discard(session)
+        self.profiles.pop(session, None)
+        old_partner = self.partners.pop(session, None)
+        if old_partner is not None:
+            del self.partners[old_partner]
+            old_partner.peer_left(session, disconnect_reason)
+            self.on_join(old_partner, self.profiles.get(old_partner, set()))
 
 matchmaker = Matchmaker()
 
+# how often per-node counts get passed around and the online total gets recounted. a count from
+# another worker is at most about two of these old by the time anyone sees it
+PRESENCE_INTERVAL = 2
+
+class Presence:
+    # how many people are online across every node (worker process). this node's own count is read
+    # fresh, the others are whatever they last reported. the total is cached and recounted at most once
+    # per interval, and whoever is sitting in the waiting view gets the new number written over their
+    # "online right now" line instead of a repaint
+    def __init__(self, local=None, interval=PRESENCE_INTERVAL, clock=time.monotonic):
+        self.local = local
+        self.interval = interval
+        self.clock = clock
+        self.nodes = {}
+        self.changed = False
+        self.total = None
+        self.refreshed = None
+        self.watchers = set()
+        self.task = None
+
+    def report(self, node, count):
+        if self.nodes.get(node) != count:
+            self.nodes[node] = count
+            self.changed = True
+
+    def forget(self, node):
+        if self.nodes.pop(node, None) is not None:
+            self.changed = True
+
+    def online_count(self):
+        if self.refreshed is None or self.clock() - self.refreshed >= self.interval:
+            self.refresh()
+        return self.total
+
+    def refresh(self):
+        self.refreshed = self.clock()
+        total = sum(self.nodes.values()) + (self.local() if self.local else 0)
+        if total == self.total:
+            return
+        self.total = total
+        for session in list(self.watchers):
+            session.online_changed(total)
+
+    def watch(self, session):
+        self.watchers.add(session)
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    def unwatch(self, session):
+        self.watchers.discard(session)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                log.exception("error recounting who's online: %s", e)
+
+# matchmaker gets swapped for a BrokerClient in workers, which keeps its own active_users
+presence = Presence(local=lambda: len(matchmaker.active_users))
+
+def online_text(count):
+    #you're online even if the cached total hasn't caught up with you yet
+    count = max(1, count)
+    return f"{count} user{'s' if count != 1 else ' (just you...)'} online right now"
+
+IDLE_WARNING = 240
+IDLE_TIMEOUT = 300
+
+class IdleTimer:
+    __slots__ = ('session', 'last_active', 'warned')
+
+    def __init__(self, session, now):
+        self.session = session
+        self.last_active = now
+        self.warned = False
+
+class IdleReaper:
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        # one deadline heap for every session instead of a sleeping task per session.
+        # entries go stale when a session leaves or gets re-tracked, expire() skips those
+        self.deadlines = []
+        self.timers = {}
+        self.seq = 0
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+    def schedule(self, timer, deadline):
+        heapq.heappush(self.deadlines, (deadline, self.seq, timer))
+        self.seq += 1
+        if self.deadlines[0][2] is timer:
+            self.wakeup.set()
+
+    def track(self, session):
+        timer = IdleTimer(session, self.clock())
+        self.timers[session] = timer
+        self.schedule(timer, timer.last_active + IDLE_WARNING)
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    def touch(self, session):
+        # activity just moves the timestamp, the heap entry notices when it comes due
+        timer = self.timers.get(session)
+        if timer:
+            timer.last_active = self.clock()
+            timer.warned = False
+
+    def forget(self, session):
+        self.timers.pop(session, None)
+
+    def expire(self):
+        now = self.clock()
+        while self.deadlines and self.deadlines[0][0] <= now:
+            _, _, timer = heapq.heappop(self.deadlines)
+            if self.timers.get(timer.session) is not timer:
+                continue
+            idle = now - timer.last_active
+            if idle >= IDLE_TIMEOUT:
+                del self.timers[timer.session]
+                timer.session.idle_kick()
+            elif idle >= IDLE_WARNING and not timer.warned:
+                timer.warned = True
+                self.schedule(timer, timer.last_active + IDLE_TIMEOUT)
+                timer.session.idle_warning()
+            elif timer.warned:
+                self.schedule(timer, timer.last_active + IDLE_TIMEOUT)
+            else:
+                self.schedule(timer, timer.last_active + IDLE_WARNING)
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            #a timer instead of wait_for, which on 3.11 can swallow a cancel that lands as the event fires
+            timer = None
+            if self.deadlines:
+                timer = asyncio.get_running_loop().call_later(max(0, self.deadlines[0][0] - self.clock()), self.wakeup.set)
+            try:
+                await self.wakeup.wait()
+            finally:
+                if timer:
+                    timer.cancel()
+            try:
+                self.expire()
+            except Exception as e:
+                log.exception("error in idle reaper: %s", e)
+
+idle_reaper = IdleReaper()
+
+RESUME_GRACE = 120
+RESUME_MAX_SESSIONS = 5000
+
+class ResumeCache:
+    # sessions whose connection dropped, kept around for a bit so `ssh <token>@host` can pick them back up.
+    # a paired session stays paired while it's parked, the partner just keeps typing into its history
+    def __init__(self, grace=RESUME_GRACE, max_sessions=RESUME_MAX_SESSIONS):
+        self.grace = grace
+        self.max_sessions = max_sessions
+        self.parked = OrderedDict()
+        # token -> session for everyone connected right now. a silent network change takes keepalives
+        # the best part of a minute to notice, someone reconnecting before that takes the chat over
+        self.live = {}
+        # off in --workers mode, a reconnect lands on whichever worker the kernel picks and the chat
+        # only lives in one of them
+        self.enabled = True
+
+    def attach(self, session):
+        if self.enabled:
+            self.live[session.resume_token] = session
+
+    def detach(self, session):
+        if self.live.get(session.resume_token) is session:
+            del self.live[session.resume_token]
+
+    def park(self, session):
+        while len(self.parked) >= self.max_sessions:
+            self.expire(next(iter(self.parked)))
+        timer = asyncio.get_running_loop().call_later(self.grace, self.expire, session.resume_token)
+        self.parked[session.resume_token] = (session, timer)
+        metrics.resume.inc(event="parked")
+
+    def claim(self, token):
+        session = self.live.get(token)
+        if session is not None and not session.awaiting_interests:
+            del self.live[token]
+            metrics.resume.inc(event="taken over")
+            return session
+        entry = self.parked.pop(token, None)
+        if entry is None:
+            return None
+        session, timer = entry
+        timer.cancel()
+        metrics.resume.inc(event="resumed")
+        return session
+
+    def expire(self, token):
+        session, timer = self.parked.pop(token)
+        timer.cancel()
+        metrics.resume.inc(event="expired")
+        session.resume_expired()
+
+resume_cache = ResumeCache()
+
 #add more? https://patorjk.com/software/taag/#p=display&f=Isometric3&t=TERMEGLE&x=none&v=4&h=4&w=80&we=false
 ASCII_ARTS = [
     """
@@ -130,29 +814,390 @@ ASCII_ARTS = [
     """
 ]
 
+HISTORY_LIMIT = 2000
+DISPLAY_LIMIT = 256
+
+def paint_line(color, text):
+    # a screen line: the raw text (for wrap math) and what actually gets written
+    return (text, f"\033[{color}m{text}\033[0m")
+
+def wrap_line(line, width):
+    # splits a screen line into rows that fit, so a long message takes the rows it really does.
+    # wide (cjk, emoji) characters take two columns
+    text, painted = line
+    if len(text) < width and text.isascii():
+        return (line,)
+    color = painted[:painted.index("m") + 1]
+    rows = []
+    start = used = 0
+    for i, ch in enumerate(text):
+        cols = 2 if unicodedata.east_asian_width(ch) in "WF" else 1
+        if used + cols > width:
+            rows.append(text[start:i])
+            start, used = i, 0
+        used += cols
+    rows.append(text[start:])
+    if len(rows) == 1:
+        return (line,)
+    return tuple((row, f"{color}{row}\033[0m") for row in rows)
+
+class Message:
+    # never changed once it's made. a chat line is one of these shared by both sides' histories,
+    # with the painted "you" and "stranger" lines built once here instead of on every render
+    __slots__ = ('time', 'role', 'text', 'show_timestamp', 'author', 'you_line', 'stranger_line')
+
+    def __init__(self, time, role, text, show_timestamp, author=None):
+        self.time = time
+        self.role = role
+        self.text = text
+        self.show_timestamp = show_timestamp
+        self.author = author
+        if role == "chat":
+            self.you_line = paint_line("34", f"{time} you: {text}")
+            self.stranger_line = paint_line("31", f"{time} stranger: {text}")
+
+    def role_for(self, viewer):
+        if self.role == "chat":
+            return "you" if self.author is viewer else "stranger"
+        return self.role
+
+    def hidden_when_matched(self):
+        if self.role == "chat":
+            return False
+        return "online right now" in self.text or self.text == "finding you a stranger to chat with..." or self.text == "stranger disconnected." or self.text == "the stranger was disconnected for inactivity."
+
+class ChatHistory:
+    def __init__(self, limit=HISTORY_LIMIT, display_limit=DISPLAY_LIMIT):
+        # oldest messages fall off the front once a chat gets long
+        self.log = deque(maxlen=limit)
+        # what the matched view shows, filtered as messages come in instead of on every render
+        self.chat_view = deque(maxlen=display_limit)
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.log)
+
+    def append(self, msg):
+        if len(self.log) == self.log.maxlen:
+            self.dropped += 1
+        self.log.append(msg)
+        if not msg.hidden_when_matched():
+            self.chat_view.append(msg)
+
+    def clear(self):
+        self.log.clear()
+        self.chat_view.clear()
+        self.dropped = 0
+
+    def recent(self, count, matched):
+        view = self.chat_view if matched else self.log
+        # deques index fast near the ends, so this is O(count)
+        return [view[i] for i in range(max(0, len(view) - count), len(view))]
+
+    def snapshot(self):
+        # a save streams out over several ticks while new messages keep landing in the log
+        return list(self.log)
+
+def transcript_line(msg, viewer):
+    role = msg.role_for(viewer)
+    if role == "system" or role == "matched":
+        if msg.show_timestamp:
+            return f"{msg.time} [SYSTEM] {msg.text}\r\n"
+        return f"[SYSTEM] {msg.text}\r\n"
+    elif role == "stranger":
+        return f"{msg.time} [STRANGER] {msg.text}\r\n"
+    elif role == "you":
+        return f"{msg.time} [YOU] {msg.text}\r\n"
+    return ""
+
+def clipboard_chunks(messages, viewer):
+    # OSC 52 puts the transcript on the client's clipboard (if their terminal allows it).
+    # base64 goes out a bit at a time, leftover bytes wait for the next line so every piece is whole
+    yield "\033]52;c;"
+    pending = b""
+    for msg in messages:
+        pending += transcript_line(msg, viewer).encode()
+        cut = len(pending) - len(pending) % 3
+        if cut:
+            yield base64.b64encode(pending[:cut]).decode()
+            pending = pending[cut:]
+    yield base64.b64encode(pending).decode() + "\a"
+
+MAX_MESSAGE_LENGTH = 500
+# per session lines the pty editor remembers for up-arrow, asyncssh keeps 1000 by default
+LINE_HISTORY = 20
+
+LINE_END = re.compile(r"\r\n|\r|\n")
+# control characters plus the bidi overrides that can flip the rest of someone else's screen around
+UNSAFE = re.compile("[\x00-\x1f\x7f-\x9f\u200b-\u200f\u202a-\u202e\u2066-\u2069]")
+UNSAFE_BUT_BACKSPACE = re.compile("[\x00-\x07\x09-\x1f\x80-\x9f\u200b-\u200f\u202a-\u202e\u2066-\u2069]")
+ESCAPE = re.compile(r"\x1b(\[[0-9;?]*[ -/]*[@-~]|O.|.)?", re.DOTALL)
+ESCAPE_START = re.compile(r"\x1b(\[[0-9;?]*[ -/]*|O)?$")
+
+def clean_line(text):
+    #arrow keys and the like mean nothing without the editor, backspace eats the character before it
+    text = UNSAFE_BUT_BACKSPACE.sub("", ESCAPE.sub("", text).replace("\t", " "))
+    if "\x7f" not in text and "\b" not in text:
+        return text
+    kept = []
+    for ch in text:
+        if ch == "\x7f" or ch == "\b":
+            if kept:
+                kept.pop()
+        else:
+            kept.append(ch)
+    return "".join(kept)
+
+class LineBuffer:
+    # with a pty asyncssh's line editor hands over one finished line at a time (and does backspace,
+    # arrows and history itself). without one the client sends whatever it likes in whatever chunks,
+    # so this splits that into lines and never holds more than one message worth of text
+    def __init__(self, limit=MAX_MESSAGE_LENGTH):
+        self.limit = limit
+        self.partial = ""
+        self.after_cr = False
+
+    def feed(self, data):
+        if self.after_cr and data.startswith("\n"):
+            data = data[1:]
+        self.after_cr = data.endswith("\r")
+        pieces = LINE_END.split(self.partial + data)
+        lines = []
+        for line in pieces[:-1]:
+            if UNSAFE.search(line):
+                line = clean_line(line)
+            lines.append(line[:self.limit])
+
+        #the unfinished line, minus whatever went past the limit. a half arrived escape waits for the rest
+        rest, held = pieces[-1], ""
+        if UNSAFE.search(rest):
+            tail = ESCAPE_START.search(rest)
+            if tail:
+                rest, held = rest[:tail.start()], rest[tail.start():]
+            rest = clean_line(rest)
+        self.partial = rest[:self.limit] + held[:16]
+        return lines
+
+COMMANDS_LINE = "commands: 'save' to view full chat | 'next' for new stranger | 'quit' to exit"
+SEPARATOR = "─" * 78
+SAVE_COMMANDS_LINE = "'next'/'prev' to flip pages | 'copy' to clipboard | 'back' to chat | 'quit'"
+# transcript lines written per event loop tick while a save streams out
+STREAM_CHUNK = 64
+# bytes a session may have waiting on a client that stopped reading before it gets cut off
+OUTPUT_LIMIT = 256 * 1024
+
+class FrameCache:
+    # the banner and interest prompt are the same for everyone with the same art and terminal width,
+    # so they're built once and every session writes the same string
+    def __init__(self, limit=64):
+        self.limit = limit
+        self.frames = OrderedDict()
+
+    def get(self, key, build):
+        frame = self.frames.get(key)
+        if frame is None:
+            frame = self.frames[key] = build()
+            if len(self.frames) > self.limit:
+                self.frames.popitem(last=False)
+        else:
+            self.frames.move_to_end(key)
+        return frame
+
+    def banner(self, art, width):
+        #art wider than the terminal wraps into garbage, so clip it
+        return self.get(("banner", art, width), lambda: "\033[2J\033[H\r\n" + "\n".join(line[:width - 1].rstrip() for line in ASCII_ARTS[art].split("\n")) + "\r\n\r\n")
+
+    def banner_rows(self, art, width):
+        return self.get(("banner_rows", art, width), lambda: self.banner(art, width).count("\n"))
+
+    def interests_prompt(self, art, width):
+        return self.get(("interests", art, width), lambda: self.banner(art, width)
+                        + "\033[36mwhat are your interests? enter to skip (separate with commas)\033[0m\r\n"
+                        + "\033[36mexample: gaming, sports, pb and j\033[0m\r\n\r\n"
+                        + "> ")
+
+frame_cache = FrameCache()
+
 class ChatSession(asyncssh.SSHServerSession):
     def __init__(self):
+        # no channel yet for sessions restored from a handover until their user comes back
+        self._chan = None
         self.partner = None
-        self.messages = [] 
-        self.art = random.choice(ASCII_ARTS)
+        self.messages = ChatHistory()
+        # doubles as the ssh username that gets this session back after a dropped connection, and it's
+        # the only thing needed to take over the chat, so 96 bits so nobody guesses their way in
+        self.resume_token = secrets.token_hex(12)
+        self.resuming = False
+        self.closed = False
+        self.art = random.randrange(len(ASCII_ARTS))
         self.terminal_height = 24
+        self.terminal_width = 80
+        # what the client screen shows right now: (text, painted) per message line, None means unknown
+        self.screen = None
+        self.screen_layout = None
+        # rows of the "finding you a stranger" and "online right now" lines in the waiting view, where
+        # queue and online count updates go
+        self.status_row = None
+        self.online_row = None
+        # output gathered during one event loop tick, sent as a single channel write
+        self.outbuf = []
+        self.frames_only = True
+        self.flush_scheduled = False
+        self.writing_paused = False
+        self.render_pending = False
+        self.bytes_buffered = 0
+        self.bytes_sent = 0
+        self.frames_dropped = 0
+        # channels swapped out by a reconnect whose connection_lost hasn't come in yet
+        self.replaced = 0
         self.visible_lines = None
         self.save_mode = False
+        # lines still to go out for the current save, and (snapshot, page start indexes) while paging
+        self.streaming = None
+        self.pump_scheduled = False
+        self.pager = None
+        # while a stream is inside an escape sequence (the clipboard copy): what closes it if the stream
+        # gets cut short, and every other write, held back until it's done
+        self.stream_closing = None
+        self.held = None
         self.matched = False
-        self.last_active = datetime.now()
+        self.message_bucket = TokenBucket(MESSAGE_BURST, time.monotonic())
         self.chat_count = 0
         self.interests = set()
         self.awaiting_interests = True
-        self.interest_buffer = ""
+        self.input = LineBuffer()
 
     def connection_made(self, chan):
+        if self._chan is not None and not self._chan.is_closing():
+            #taken over by a reconnect while the old connection is still hanging on, cut it loose
+            self.replaced += 1
+            self._chan.get_connection().abort()
         self._chan = chan
 
     def shell_requested(self):
         return True
 
+    def write(self, data, frame=False):
+        if self.held is not None:
+            #would land in the middle of the clipboard escape sequence and garble it
+            self.held.append((data, frame))
+            return
+        self.send(data, frame)
+
+    def send(self, data, frame=False):
+        if self.closed:
+            return
+        if not frame:
+            if self.render_pending:
+                self.render_pending = False
+                if self.writing_paused:
+                    #stale by the time anything goes out, whatever renders next repaints in full
+                    self.screen = None
+                    self.frames_dropped += 1
+                    metrics.frames_dropped.inc()
+                else:
+                    #keep ordering, the skipped frame goes out before this
+                    self.draw()
+            self.frames_only = False
+        if self.bytes_buffered + len(data) > OUTPUT_LIMIT:
+            self.overflow()
+            return
+        self.outbuf.append(data)
+        self.bytes_buffered += len(data)
+        if not self.flush_scheduled and not self.writing_paused:
+            self.flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self.flush)
+
+    def flush(self):
+        self.flush_scheduled = False
+        if self.writing_paused or not self.outbuf:
+            return
+        data = "".join(self.outbuf)
+        self.outbuf.clear()
+        self.frames_only = True
+        self.bytes_buffered = 0
+        if self._chan is None or self._chan.is_closing():
+            return
+        self._chan.write(data)
+        self.bytes_sent += len(data)
+
+    def overflow(self):
+        log.warning("client stopped reading with %d bytes waiting, disconnecting it", self.bytes_buffered)
+        metrics.overflows.inc()
+        self.outbuf.clear()
+        self.bytes_buffered = 0
+        if self._chan is not None and not self.closed:
+            self.close()
+
+    def close(self):
+        self.stop_stream()
+        self.closed = True
+        self.render_pending = False
+        self.writing_paused = False
+        self.flush()
+        self._chan.close()
+
+    def pause_writing(self):
+        # client isn't draining, stop sending until asyncssh says the channel has room again
+        self.writing_paused = True
+
+    def resume_writing(self):
+        self.writing_paused = False
+        if self.render_pending:
+            self.render_pending = False
+            self.draw()
+        self.flush()
+        if not self.pump_scheduled:
+            self.pump()
+
+    def stream(self, chunks, closing=None):
+        # closing: the end of an escape sequence the chunks open, nothing else gets written until the
+        # stream is done and it's sent if the stream is cut short
+        self.stop_stream()
+        self.streaming = iter(chunks)
+        if closing is not None:
+            #the opening goes out right away, so there's always something for closing to close
+            self.send(next(self.streaming, ""))
+            self.held = []
+            self.stream_closing = closing
+        #a pump that's already due picks the new stream up, two of them would double the chunk per tick
+        if not self.pump_scheduled:
+            self.pump()
+
+    def stop_stream(self):
+        if self.streaming is None:
+            return
+        self.streaming = None
+        if self.stream_closing is not None:
+            self.send(self.stream_closing)
+        self.release()
+
+    def release(self):
+        held, self.held = self.held, None
+        self.stream_closing = None
+        for data, frame in held or ():
+            self.write(data, frame)
+
+    def pump(self):
+        #a chunk per tick so a long log doesn't hog the loop, and nothing while the client is backed up
+        self.pump_scheduled = False
+        if self.streaming is None or self.writing_paused or self.closed:
+            return
+        for _ in range(STREAM_CHUNK):
+            chunk = next(self.streaming, None)
+            if chunk is None:
+                self.streaming = None
+                self.release()
+                return
+            self.send(chunk)
+            if self.stream_closing is not None and chunk.endswith(self.stream_closing):
+                self.release()  #sequence closed, the rest can mix with everything else again
+        self.pump_scheduled = True
+        asyncio.get_running_loop().call_soon(self.pump)
+
     def terminal_size_changed(self, width, height, pixwidth, pixheight):
         self.terminal_height = height if height > 0 else 24
+        self.terminal_width = width if width > 0 else 80
         self.visible_lines = max(5, self.terminal_height - 18)
         if not self.save_mode and not self.awaiting_interests:
             self.render()
@@ -160,88 +1205,220 @@ class ChatSession(asyncssh.SSHServerSession):
     def _timestamp(self):
         return datetime.now().strftime("[%H:%M]")
 
-    def render(self):
-        self._chan.write("\033[2J\033[H")
-
-        if not self.matched:
-            self._chan.write("\r\n")
-            self._chan.write(self.art)
-            self._chan.write("\r\n\r\n")
-
+    def render_lines(self):
         if self.visible_lines is None:
             lines_to_show = 20
         else:
             lines_to_show = self.visible_lines
 
-        if self.matched:
-            filtered_messages = []
-            for msg in self.messages:
-                msg_time, role, text, show_timestamp = msg
-                if "online right now" in text or text == "finding you a stranger to chat with..." or text == "stranger disconnected." or text == "the stranger was disconnected for inactivity.":
-                    continue
-                filtered_messages.append(msg)
-        else:
-            filtered_messages = self.messages
-
-        recent_messages = filtered_messages[-lines_to_show:] if len(filtered_messages) > lines_to_show else filtered_messages
-        
-        for msg_time, role, text, show_timestamp in recent_messages:
-            if role == "system" and text == "─" * 78 and self.chat_count > 0: #some really reliable code
-                self._chan.write(f"\033[36myou've chatted with {self.chat_count} stranger{'s' if self.chat_count != 1 else ''} this session!\033[0m\r\n")
-            if role == "system":
+        recent_messages = self.messages.recent(lines_to_show, self.matched)
+
+        lines = []
+        for msg in recent_messages:
+            msg_time, role, text, show_timestamp = msg.time, msg.role, msg.text, msg.show_timestamp
+            if role == "chat":
+                #already painted, and the same tuple every render so the screen diff compares by identity
+                lines.append(msg.you_line if msg.author is self else msg.stranger_line)
+            elif role == "system":
+                if text == SEPARATOR and self.chat_count > 0: #some really reliable code
+                    lines.append(paint_line("36", f"you've chatted with {self.chat_count} stranger{'s' if self.chat_count != 1 else ''} this session!"))
+                if text.endswith("online right now") and presence.total is not None:
+                    text = online_text(presence.total)  #the count moves on after the line was added
                 if show_timestamp:
-                    self._chan.write(f"\033[36m{msg_time} {text}\033[0m\r\n")
+                    lines.append(paint_line("36", f"{msg_time} {text}"))
                 else:
-                    self._chan.write(f"\033[36m{text}\033[0m\r\n")
+                    lines.append(paint_line("36", text))
             elif role == "matched":
-                self._chan.write(f"\033[33m{text}\033[0m\r\n")
-            elif role == "stranger":
-                self._chan.write(f"\033[31m{msg_time} stranger: {text}\033[0m\r\n")
-            elif role == "you":
-                self._chan.write(f"\033[34m{msg_time} you: {text}\033[0m\r\n")
+                lines.append(paint_line("33", text))
+
+        #long messages wrap onto extra rows, the oldest rows go so the view stays the same height
+        width = max(1, self.terminal_width - 1)
+        rows = []
+        for line in lines:
+            if len(line[0]) < width and line[0].isascii():
+                rows.append(line)
+            else:
+                rows.extend(wrap_line(line, width))
+        if len(rows) > lines_to_show:
+            del rows[:len(rows) - lines_to_show]
+        return rows
 
-        self._chan.write("\r\n> ")
+    def render(self):
+        if self.save_mode:
+            #the chat gets repainted in full on 'back'
+            self.screen = None
+            return
+        if self.writing_paused:
+            #slow reader, collapse every frame until it catches up into one full repaint
+            if self.render_pending:
+                self.frames_dropped += 1
+                metrics.frames_dropped.inc()
+            self.render_pending = True
+            self.screen = None
+            return
+        self.draw()
+
+    def draw(self):
+        started = time.perf_counter()
+        kind = self.paint()
+        metrics.render_seconds.observe(time.perf_counter() - started, kind=kind)
+
+    def paint(self):
+        lines = self.render_lines()
+        layout = (self.matched, self.visible_lines, self.terminal_width, self.terminal_height)
+
+        if self.matched and self.screen is not None and layout == self.screen_layout:
+            update = self.screen_update(self.screen, lines)
+            if update is not None:
+                self.write(update, frame=True)
+                self.screen = lines
+                metrics.render_bytes.observe(len(update), kind="diff")
+                return "diff"
+
+        #full repaint: first render, resize, mode switch or something we can't diff
+        if self.outbuf and self.frames_only:
+            #nothing sent yet this tick but older frames, which this one paints over
+            self.outbuf.clear()
+            self.bytes_buffered = 0
+            self.frames_dropped += 1
+            metrics.frames_dropped.inc()
+        buffered = self.bytes_buffered
+        self.status_row = None
+        self.online_row = None
+        if self.matched:
+            self.write("\033[2J\033[H", frame=True)
+        else:
+            self.write(frame_cache.banner(self.art, self.terminal_width), frame=True)
+            row = frame_cache.banner_rows(self.art, self.terminal_width) + 1
+            for text, painted in lines:
+                if text == "finding you a stranger to chat with...":
+                    self.status_row = row
+                elif text.endswith("online right now"):
+                    self.online_row = row
+                row += 1
+            if row + 1 > self.terminal_height:
+                #scrolled, the row numbers are off
+                self.status_row = None
+                self.online_row = None
+        #parked and restored sessions still get painted, but nobody's there to see the count move
+        if self.online_row is not None and self._chan is not None and not self._chan.is_closing():
+            presence.watch(self)
+        else:
+            presence.unwatch(self)
+
+        for text, painted in lines:
+            self.write(painted + "\r\n", frame=True)
+
+        self.write("\r\n> ", frame=True)
+        self.screen = lines
+        self.screen_layout = layout
+        metrics.render_bytes.observe(self.bytes_buffered - buffered, kind="full")
+        return "full"
+
+    def screen_update(self, old, new):
+        # only the matched view is diffed, it has no art so message line i sits on row i + 1.
+        # returns None when a full repaint is needed instead
+        if len(new) + 2 > self.terminal_height:
+            return None
+
+        #how many lines scrolled off the top (0 = pure append)
+        for scrolled in range(len(old) + 1):
+            kept = len(old) - scrolled
+            if new[:kept] == old[scrolled:]:
+                break
+        if kept == 0 and old:
+            return None
+
+        out = []
+        if scrolled:
+            #scroll just the message region so the kept lines move up without being resent
+            out.append(f"\033[1;{len(old)}r\033[{len(old)};1H")
+            out.append("\n" * scrolled)
+            out.append("\033[r")
+        for row in range(kept, len(new)):
+            out.append(f"\033[{row + 1};1H\033[K{new[row][1]}")
+        #blank line then the prompt, clearing the old prompt and whatever was echoed after it
+        out.append(f"\033[{len(new) + 1};1H\033[J\r\n> ")
+        return "".join(out)
 
     def show_full_chat(self):
         self.save_mode = True
-
-        self._chan.write("\033[2J\033[H")
-
-        self._chan.write("=" * 60 + "\r\n")
-        self._chan.write("TERMEGLE CHAT LOG\r\n")
-        self._chan.write(f"saved: {datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')}\r\n")
-        self._chan.write(f"total messages: {len(self.messages)}\r\n")
-        self._chan.write("=" * 60 + "\r\n")
-        self._chan.write("\r\n")
-
-        for msg_time, role, text, show_timestamp in self.messages:
-            if role == "system" or role == "matched":
-                if show_timestamp:
-                    self._chan.write(f"{msg_time} [SYSTEM] {text}\r\n")
-                else:
-                    self._chan.write(f"[SYSTEM] {text}\r\n")
-            elif role == "stranger":
-                self._chan.write(f"{msg_time} [STRANGER] {text}\r\n")
-            elif role == "you":
-                self._chan.write(f"{msg_time} [YOU] {text}\r\n")
-
-        self._chan.write("\r\n")
-        self._chan.write("=" * 60 + "\r\n")
-        self._chan.write("end of chat log - select all and copy to save!\r\n")
-        self._chan.write("=" * 60 + "\r\n")
-        self._chan.write("\r\n")
-        self._chan.write("type 'back' to return to chat, or 'quit' to exit\r\n")
-        self._chan.write("> ")
+        self.screen = None
+        self.pager = None
+
+        self.write("\033[2J\033[H")
+
+        self.write("=" * 60 + "\r\n")
+        self.write("TERMEGLE CHAT LOG\r\n")
+        self.write(f"saved: {datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')}\r\n")
+        self.write(f"total messages: {len(self.messages) + self.messages.dropped}\r\n")
+        if self.messages.dropped:
+            self.write(f"(only the last {len(self.messages)} are kept)\r\n")
+        self.write("=" * 60 + "\r\n")
+        self.write("\r\n")
+
+        self.stream(self.full_chat_lines(self.messages.snapshot()))
+
+    def full_chat_lines(self, messages):
+        for msg in messages:
+            yield transcript_line(msg, self)
+        yield "\r\n"
+        yield "=" * 60 + "\r\n"
+        yield "end of chat log - select all and copy to save!\r\n"
+        yield "=" * 60 + "\r\n"
+        yield "\r\n"
+        yield SAVE_COMMANDS_LINE + "\r\n"
+        yield "> "
+
+    def clipboard_lines(self):
+        yield from clipboard_chunks(self.messages.snapshot(), self)
+        yield "\r\nsent the log to your clipboard (if your terminal lets it)\r\n> "
+
+    def show_page(self, step):
+        if self.pager is None:
+            #first 'next' or 'prev' opens the pager on page 1
+            self.pager = (self.messages.snapshot(), [0])
+            step = 0
+        messages, starts = self.pager
+        if step > 0:
+            end = self.page_end(messages, starts[-1])
+            if end < len(messages):
+                starts.append(end)
+        elif step < 0 and len(starts) > 1:
+            starts.pop()
+        start = starts[-1]
+        end = self.page_end(messages, start)
+
+        self.stop_stream()
+        self.write("\033[2J\033[H")
+        self.write(f"chat log page {len(starts)} - messages {start + 1}-{end} of {len(messages)}\r\n")
+        self.write("=" * 60 + "\r\n")
+        for msg in messages[start:end]:
+            self.write(transcript_line(msg, self))
+        self.write("=" * 60 + "\r\n")
+        self.write(SAVE_COMMANDS_LINE + "\r\n")
+        self.write("> ")
+
+    def page_end(self, messages, start):
+        #fill the screen minus the header and footer, counting the rows long lines wrap onto
+        rows = self.terminal_height - 5
+        width = max(1, self.terminal_width)
+        end = start
+        while end < len(messages):
+            rows -= max(1, (len(transcript_line(messages[end], self)) - 2 + width - 1) // width)
+            if rows < 0 and end > start:
+                break
+            end += 1
+        return end
 
     def add_message(self, role, text, show_timestamp=True):
         timestamp = self._timestamp()
-        self.messages.append((timestamp, role, text, show_timestamp))
+        self.messages.append(Message(timestamp, role, text, show_timestamp))
 
     def clear_chat_and_reset(self, disconnect_reason=None):
 
-        self.messages = []
-        online_count = len(matchmaker.active_users)
-        self.add_message("system", f"{online_count} user{'s' if online_count != 1 else ' (just you...)'} online right now", show_timestamp=False)
+        self.messages.clear()
+        self.add_message("system", online_text(presence.online_count()), show_timestamp=False)
 
         if disconnect_reason:
             self.add_message("matched", disconnect_reason, show_timestamp=False)
@@ -249,106 +1426,182 @@ class ChatSession(asyncssh.SSHServerSession):
             self.add_message("matched", "stranger disconnected.", show_timestamp=False)
         self.add_message("system", "finding you a stranger to chat with...", show_timestamp=False)
 
-        self.add_message("system", "commands: 'save' to view full chat | 'next' for new stranger | 'quit' to exit", show_timestamp=False)
-        self.add_message("system", "─" * 78, show_timestamp=False)
+        self.add_message("system", COMMANDS_LINE, show_timestamp=False)
+        if resume_cache.enabled:
+            self.add_message("system", self.resume_hint(), show_timestamp=False)
+        self.add_message("system", SEPARATOR, show_timestamp=False)
+
+    def resume_hint(self):
+        return f"dropped? ssh in as {self.resume_token} within {RESUME_GRACE // 60} min to get back here"
 
     def session_started(self):
-        matchmaker.active_users.add(self)
-
-        self._chan.write("\033[2J\033[H")
-        self._chan.write("\r\n")
-        self._chan.write(self.art)
-        self._chan.write("\r\n\r\n")
-        self._chan.write("\033[36mwhat are your interests? enter to skip (separate with commas)\033[0m\r\n")
-        self._chan.write("\033[36mexample: gaming, sports, pb and j\033[0m\r\n\r\n")
-        self._chan.write("> ")
-
-    async def match_user(self, from_next=False):
-        if self in [s for s in matchmaker.waiting.keys()]:
-            del matchmaker.waiting[self]
-
-        partner, common_interests, show_next_warning = await matchmaker.find_match(self, self.interests, from_next)
-
-        if partner:
-            self.partner = partner
-            partner.partner = self
-
-            self.matched = True
-            partner.matched = True
-            self.chat_count += 1
-            partner.chat_count += 1
+        width, height, _, _ = self._chan.get_terminal_size()
+        self.terminal_width = width if width > 0 else 80
+        self.terminal_height = height if height > 0 else 24
+        if self.resuming:
+            self.resume()
+            return
+
+        resume_cache.attach(self)
+        matchmaker.add_user(self)
+        self.write(frame_cache.interests_prompt(self.art, self.terminal_width))
+
+    def resume(self):
+        #same session object on a new channel, whatever the old screen showed is gone
+        log.info("session %s resumed", self.resume_token)
+        self.resuming = False
+        self.closed = False
+        self.save_mode = False
+        self.streaming = None
+        self.held = None
+        self.stream_closing = None
+        self.pager = None
+        self.screen = None
+        self.writing_paused = False
+        self.render_pending = False
+        #anything still waiting was meant for the old connection
+        self.outbuf.clear()
+        self.bytes_buffered = 0
+        self.visible_lines = max(5, self.terminal_height - 18)
+        resume_cache.attach(self)
+
+        if self.partner is None:
+            #lost the partner (or never had one) while away, unpark puts us back in the queue
+            self.add_message("system", "welcome back! finding you a stranger to chat with...", show_timestamp=False)
+        else:
+            self.add_message("system", "welcome back! you're still talking to the same stranger.", show_timestamp=False)
+            self.partner.peer_notice(self, "the stranger is back!")
+        matchmaker.unpark(self)
+        idle_reaper.track(self)
+        self.render()
+
+    def restarting(self):
+        #this process is handing over to a new one, the chat waits in its resume cache
+        if self.awaiting_interests:
+            self.write("\r\nserver restarting, ssh back in in a sec!\r\n")
+        else:
+            self.write(f"\r\n\033[33mserver restarting! ssh back in as {self.resume_token} within {RESUME_GRACE // 60} min to pick up this chat\033[0m\r\n")
+        self.close()
+
+    def dropped(self):
+        if self.partner is not None:
+            self.partner.peer_notice(self, f"the stranger's connection dropped, giving them {RESUME_GRACE // 60} min to come back...")
+        presence.unwatch(self)
+        matchmaker.park(self)
+
+    def resume_expired(self):
+        log.info("session %s never came back", self.resume_token)
+        matchmaker.leave(self, "the stranger's connection dropped.")
+        presence.unwatch(self)
+        self.partner = None
+
+    def interests_text(self, common_interests):
+        interests_list = sorted(list(common_interests))
+        if len(interests_list) == 1:
+            return f"you both like {interests_list[0]}."
+        elif len(interests_list) == 2:
+            return f"you both like {interests_list[0]} and {interests_list[1]}."
+        else:
+            return f"you both like {', '.join(interests_list[:-1])}, and {interests_list[-1]}."
+
+    # paired and peer_left come from the matchmaker, which owns who is paired with who.
+    # the peer_* methods are what the partner calls on us, it can be another ChatSession or a
+    # RemoteSession living in another worker process
+    def paired(self, partner, common_interests, joined=False):
+        self.partner = partner
+        self.matched = True
+        self.chat_count += 1
+        if joined:
             self.add_message("matched", "connected to a stranger!", show_timestamp=False)
+        if common_interests:
+            self.add_message("matched", self.interests_text(common_interests), show_timestamp=False)
+        if not joined:
+            self.add_message("matched", "connected to a stranger!", show_timestamp=False)
+        self.render()
 
-            if common_interests:
-                interests_list = sorted(list(common_interests))
-                if len(interests_list) == 1:
-                    interests_text = f"you both like {interests_list[0]}."
-                elif len(interests_list) == 2:
-                    interests_text = f"you both like {interests_list[0]} and {interests_list[1]}."
-                else:
-                    interests_text = f"you both like {', '.join(interests_list[:-1])}, and {interests_list[-1]}."
-                
-                self.add_message("matched", interests_text, show_timestamp=False)
-                partner.add_message("matched", interests_text, show_timestamp=False)
-            
-            self.render()
+    def queue_status(self, position, estimate):
+        #rewrites just the "finding you a stranger" line, cursor saved and put back around it
+        if self.partner is not None or self.save_mode or self.status_row is None or self.writing_paused:
+            return
+        text = f"finding you a stranger to chat with... #{position} in line"
+        if estimate is not None:
+            text += f", about {estimate}s"
+        if len(text) >= self.terminal_width:
+            return
+        self.write(f"\0337\033[{self.status_row};1H\033[K\033[36m{text}\033[0m\0338")
 
-            partner.add_message("matched", "connected to a stranger!", show_timestamp=False)
-            partner.render()
+    def online_changed(self, count):
+        #same trick as queue_status for the online count line
+        if self.partner is not None or self.save_mode or self.online_row is None or self.writing_paused:
+            return
+        self.write(f"\0337\033[{self.online_row};1H\033[K\033[36m{online_text(count)}\033[0m\0338")
 
-    async def handle_next(self):
-        old_partner = self.partner
+    def peer_message(self, partner, msg):
+        #msg is the sender's own Message, our history just holds another reference to it
+        if self.partner != partner:
+            return
+        self.messages.append(msg)
+        self.render()
 
-        #disconnect
-        if old_partner:
-            old_partner.partner = None
-            old_partner.matched = False
+    def peer_saved(self, partner, t):
+        if self.partner != partner:
+            return
+        self.add_message("system", f"{t} the stranger saved the chat log.", show_timestamp=False)
+        self.render()
 
+    def peer_notice(self, partner, text):
+        if self.partner != partner:
+            return
+        self.add_message("system", text, show_timestamp=False)
+        self.render()
+
+    def peer_left(self, partner, disconnect_reason=None):
+        #the matchmaker has already put us back in the queue
+        if self.partner != partner:
+            return
+        self.clear_chat_and_reset(disconnect_reason)
+        self.partner = None
+        self.matched = False
+        self.render()
+
+    def handle_next(self):
         #repeat @s
         self.partner = None
         self.matched = False
         self.clear_chat_and_reset()
         self.render()
 
-        #you get matched first 
-        await self.match_user(from_next=True)
-        await asyncio.sleep(0.1)
+        #the matchmaker unpairs the ex, matches you first and then requeues them
+        matchmaker.next(self)
 
-        #now ex can find someone
-        if old_partner:
-            old_partner.clear_chat_and_reset()
-            old_partner.render()
-            asyncio.create_task(old_partner.match_user(from_next=False))
+    def idle_warning(self):
+        metrics.idle.inc(event="warning")
+        self.add_message("system", "you'll be disconnected in 1 minute due to inactivity.", show_timestamp=False)
+        self.render()
 
-    async def goon_sesh(self):
-        warned = False
-        while True:
-            await asyncio.sleep(30)
-            if self._chan.is_closing():
-                break
-            inactive_time = (datetime.now() - self.last_active).total_seconds()
-            if inactive_time > 240 and not warned:
-                self.add_message("system", "you'll be disconnected in 1 minute due to inactivity.", show_timestamp=False)
-                self.render()
-                warned = True
-            elif inactive_time > 300:
-                self.add_message("system", "you were disconnected for being inactive for 5 minutes.", show_timestamp=False)
-                self.render()
-                self._chan.write("\r\ninactivity timeout - disconnected.\r\n")
-                self._chan.close()
-                if self.partner:
-                    matchmaker.remove(self)
-                    self.partner.clear_chat_and_reset(disconnect_reason="the stranger was disconnected for inactivity.")
-                    self.partner.partner = None
-                    self.partner.matched = False
-                    self.partner.render()
-                    asyncio.create_task(self.partner.match_user())
-                break
+    def idle_kick(self):
+        if self._chan.is_closing():
+            return
+        metrics.idle.inc(event="kick")
+        self.add_message("system", "you were disconnected for being inactive for 5 minutes.", show_timestamp=False)
+        self.render()
+        self.write("\r\ninactivity timeout - disconnected.\r\n")
+        self.close()
+        matchmaker.leave(self, "the stranger was disconnected for inactivity.")
+        self.partner = None
+        self.matched = False
 
     def data_received(self, data, datatype):
+        if isinstance(data, bytes):
+            data = data.decode("utf-8", errors="replace")
+        for line in self.input.feed(data):
+            if self.closed:
+                break
+            self.handle_line(line.strip())
+        return len(data)
+
+    def handle_line(self, msg):
         try:
-            msg = data.decode("utf-8", errors="ignore").strip() if isinstance(data, bytes) else str(data).strip()
-            
             if self.awaiting_interests:
                 if msg:
                     raw_interests = [i.strip().lower() for i in msg.split(',')]
@@ -356,77 +1609,99 @@ class ChatSession(asyncssh.SSHServerSession):
                 
                 self.awaiting_interests = False
                 
-                online_count = len(matchmaker.active_users)
-                self.add_message("system", f"{online_count} user{'s' if online_count != 1 else ' (just you...)'} online right now", show_timestamp=False)
+                self.add_message("system", online_text(presence.online_count()), show_timestamp=False)
                 self.add_message("system", "finding you a stranger to chat with...", show_timestamp=False)
-                self.add_message("system", "commands: 'save' to view full chat | 'next' for new stranger | 'quit' to exit", show_timestamp=False)
-                self.add_message("system", "─" * 78, show_timestamp=False)
+                self.add_message("system", COMMANDS_LINE, show_timestamp=False)
+                if resume_cache.enabled:
+                    self.add_message("system", self.resume_hint(), show_timestamp=False)
+                self.add_message("system", SEPARATOR, show_timestamp=False)
                 
                 self.render()
-                asyncio.create_task(self.match_user(from_next=False))
-                asyncio.create_task(self.goon_sesh())
-                return len(data)
+                matchmaker.join(self, self.interests)
+                idle_reaper.track(self)
+                return
             
             if not msg:
-                return len(data)
-            self.last_active = datetime.now()
+                return
+            idle_reaper.touch(self)
             if msg.lower() == "quit":
                 if not self.save_mode:
                     self.add_message("system", "cya!")
                     self.render()
-                self._chan.write("\r\ncya!\r\n")
-                self._chan.close()
-                return len(data)
+                self.write("\r\ncya!\r\n")
+                self.close()
+                return
 
             if msg.lower() == "back" and self.save_mode:
                 self.save_mode = False
+                self.stop_stream()
+                self.pager = None
                 self.render()
-                return len(data)
+                return
 
             if msg.lower() == "save" and not self.save_mode:
                 self.show_full_chat()
                 t = self._timestamp()
                 self.add_message("system", f"{t} you saved the chat log. (stranger can see this)", show_timestamp=False)
                 if self.partner:
-                    self.partner.add_message("system", f"{t} the stranger saved the chat log.", show_timestamp=False)
-                    self.partner.render()
-                return len(data)
+                    self.partner.peer_saved(self, t)
+                return
 
             if self.save_mode:
-                self._chan.write("Type 'back' to return to chat, or 'quit' to exit\r\n> ")
-                return len(data)
+                command = msg.lower()
+                if command in ("next", "n"):
+                    self.show_page(1)
+                elif command in ("prev", "p"):
+                    self.show_page(-1)
+                elif command == "copy":
+                    self.stream(self.clipboard_lines(), closing="\a")
+                else:
+                    self.write(SAVE_COMMANDS_LINE + "\r\n> ")
+                return
 
             if msg.lower() == "next":
-                asyncio.create_task(self.handle_next())
-                return len(data)
+                self.handle_next()
+                return
+
+            if not self.message_bucket.take(time.monotonic(), MESSAGE_RATE, MESSAGE_BURST):
+                metrics.rate_limited.inc(kind="message")
+                self.add_message("system", "slow down! that message wasn't sent.")
+                self.render()
+                return
 
             if self.partner:
-                self.add_message("you", msg)
+                metrics.messages.inc()
+                line = Message(self._timestamp(), "chat", msg, True, self)
+                self.messages.append(line)
                 self.render()
-                self.partner.add_message("stranger", msg)
-                self.partner.render()
+                self.partner.peer_message(self, line)
             else:
                 self.add_message("system", "waiting for connection...")
                 self.render()
 
         except Exception as e:
-            print(f"[{datetime.now()}] error in data_received: {e}")
-
-        return len(data)
+            log.exception("error handling input: %s", e)
 
     def connection_lost(self, exc):
-        print(f"[{datetime.now()}] user disconnected (had {len(self.messages)} messages)")
-        matchmaker.remove(self)
-        if self.partner:
-            if self.partner.matched:  #only handle if not already handled (like inactivity disconnect) (some great wording)
-                try:
-                    self.partner.clear_chat_and_reset()
-                    self.partner.partner = None
-                    self.partner.matched = False
-                    self.partner.render()
-                    asyncio.create_task(self.partner.match_user())
-                except Exception:
-                    pass
+        if self.replaced and not self._chan.is_closing():
+            #the old connection of a session that's already back on a new one
+            self.replaced -= 1
+            return
+        log.info("user disconnected (had %d messages, sent %d bytes, dropped %d frames)", len(self.messages), self.bytes_sent, self.frames_dropped)
+        self.outbuf.clear()
+        self.bytes_buffered = 0
+        #nothing reads from here on, a parked session's writes just get dropped until it's back
+        self.writing_paused = False
+        self.render_pending = False
+        idle_reaper.forget(self)
+        presence.unwatch(self)
+        resume_cache.detach(self)
+        #quit and idle kicks close on purpose, anything else is a dropped connection worth holding on to
+        if exc is not None and not self.closed and not self.awaiting_interests and resume_cache.enabled:
+            self.dropped()
+            resume_cache.park(self)
+            return
+        matchmaker.leave(self)
 
 class TermegleServer(asyncssh.SSHServer):
     def connection_made(self, conn):
@@ -434,13 +1709,16 @@ class TermegleServer(asyncssh.SSHServer):
         ip = peer[0] if peer else 'unknown'
 
         if not rate_limiter.check_rate_limit(ip):
-            print(f"[{datetime.now()}]   this guy aint slick, rate limit exceeded for {ip}")
+            log.warning("this guy aint slick, rate limit exceeded for %s", ip)
+            metrics.rate_limited.inc(kind="connection")
             conn.close()
             return
 
-        print(f"[{datetime.now()}]  new connection from {ip} (active: {len(matchmaker.active_users)})")
+        log.info("new connection from %s (active: %d)", ip, len(matchmaker.active_users))
+        metrics.connections.inc()
 
     def begin_auth(self, username):
+        self.username = username
         return False
     
     def public_key_auth_supported(self):
@@ -450,37 +1728,548 @@ class TermegleServer(asyncssh.SSHServer):
         return False
 
     def session_requested(self):
-        return ChatSession()
+        session = resume_cache.claim(self.username)
+        if session is None:
+            return ChatSession()
+        session.resuming = True
+        return session
+
+class RemoteSession:
+    # a chat partner that lives in another worker process, chat lines get relayed through the broker
+    def __init__(self, broker, sid):
+        self.broker = broker
+        self.sid = sid
+
+    def __eq__(self, other):
+        return isinstance(other, RemoteSession) and other.sid == self.sid
+
+    def __hash__(self):
+        return hash(self.sid)
+
+    def relay(self, sender, event, *args):
+        self.broker.send({"op": "relay", "to": self.sid, "from": sender.sid, "event": event, "args": list(args)})
+
+    def peer_message(self, partner, msg):
+        self.relay(partner, "message", msg.text)
+
+    def peer_saved(self, partner, t):
+        self.relay(partner, "saved", t)
+
+    def peer_notice(self, partner, text):
+        self.relay(partner, "notice", text)
+
+class BrokerClient:
+    # stands in for the Matchmaker inside a worker process, the real one lives in the broker process
+    def __init__(self, worker_id, path):
+        self.worker_id = worker_id
+        self.path = path
+        self.writer = None
+        self.sessions = {}
+        self.active_users = set()
+        self.presence = presence
+        self.next_sid = 0
+
+    async def connect(self):
+        reader, self.writer = await asyncio.open_unix_connection(self.path)
+        self.send({"op": "hello", "worker": self.worker_id})
+        asyncio.create_task(self.listen(reader))
+        asyncio.create_task(self.report_presence())
+
+    def send(self, msg):
+        self.writer.write((json.dumps(msg) + "\n").encode())
+
+    def add_user(self, session):
+        session.sid = f"{self.worker_id}:{self.next_sid}"
+        self.next_sid += 1
+        self.sessions[session.sid] = session
+        self.active_users.add(session)
+        self.send({"op": "add", "sid": session.sid})
+
+    def join(self, session, interests, from_next=False):
+        self.send({"op": "join", "sid": session.sid, "interests": sorted(interests), "from_next": from_next})
+
+    def next(self, session):
+        self.send({"op": "next", "sid": session.sid})
+
+    def park(self, session):
+        self.send({"op": "park", "sid": session.sid})
+
+    def unpark(self, session):
+        self.send({"op": "unpark", "sid": session.sid})
+
+    def leave(self, session, disconnect_reason=None):
+        if session in self.active_users:
+            self.active_users.remove(session)
+            del self.sessions[session.sid]
+            self.send({"op": "leave", "sid": session.sid, "reason": disconnect_reason})
+
+    async def report_presence(self):
+        #our own count goes to the broker once per interval at most, and only when it moved
+        reported = None
+        while True:
+            count = len(self.active_users)
+            if count != reported:
+                reported = count
+                self.send({"op": "presence", "count": count})
+            await asyncio.sleep(self.presence.interval)
+
+    async def listen(self, reader):
+        try:
+            while line := await reader.readline():
+                self.deliver(json.loads(line))
+        except Exception as e:
+            log.error("error talking to broker: %s", e)
+        log.critical("lost connection to broker, worker %s exiting", self.worker_id)
+        #os._exit skips atexit, so whatever's still queued for the listener thread has to go out now
+        if log_listener is not None:
+            log_listener.stop()
+        logging.shutdown()
+        os._exit(1)
+
+    def deliver(self, msg):
+        if msg["op"] == "presence":
+            #every other worker's count, ours we know better ourselves
+            self.presence.nodes = {node: count for node, count in msg["nodes"].items() if node != self.worker_id}
+            self.presence.refresh()
+            return
+        session = self.sessions.get(msg["sid"])
+        if session is None:
+            return  #already left, the broker hears about it soon enough
+        try:
+            if msg["op"] == "paired":
+                partner = self.sessions.get(msg["partner"]) if msg["partner"].split(":")[0] == self.worker_id else None
+                partner = partner or RemoteSession(self, msg["partner"])
+                session.paired(partner, set(msg["common"]), msg["joined"])
+                return
+            if msg["op"] == "queue":
+                session.queue_status(msg["position"], msg["estimate"])
+                return
+            #everything else is only for whoever we're paired with right now
+            if getattr(session.partner, "sid", None) != msg["partner"]:
+                return
+            if msg["op"] == "left":
+                session.peer_left(session.partner, msg["reason"])
+            elif msg["op"] == "message":
+                session.peer_message(session.partner, Message(session._timestamp(), "chat", msg["args"][0], True, session.partner))
+            elif msg["op"] == "saved":
+                session.peer_saved(session.partner, msg["args"][0])
+            elif msg["op"] == "notice":
+                session.peer_notice(session.partner, msg["args"][0])
+        except Exception as e:
+            log.exception("error delivering %s: %s", msg["op"], e)
+
+class WorkerSession:
+    # how the broker's Matchmaker sees a session that lives in a worker process
+    def __init__(self, writer, sid):
+        self.writer = writer
+        self.sid = sid
+
+    def __eq__(self, other):
+        return isinstance(other, WorkerSession) and other.sid == self.sid
+
+    def __hash__(self):
+        return hash(self.sid)
+
+    def send(self, msg):
+        self.writer.write((json.dumps(msg) + "\n").encode())
+
+    def paired(self, partner, common_interests, joined=False):
+        self.send({"op": "paired", "sid": self.sid, "partner": partner.sid, "common": sorted(common_interests), "joined": joined})
+
+    def peer_left(self, partner, disconnect_reason=None):
+        self.send({"op": "left", "sid": self.sid, "partner": partner.sid, "reason": disconnect_reason})
+
+    def queue_status(self, position, estimate):
+        self.send({"op": "queue", "sid": self.sid, "position": position, "estimate": estimate})
+
+class Broker:
+    # owns the one Matchmaker for every worker and routes chat between sessions on different workers
+    def __init__(self, patience=MATCH_PATIENCE, slo=MATCH_SLO):
+        self.matchmaker = Matchmaker(patience, slo)
+        self.workers = {}
+        self.sessions = {}
+        # per worker online counts, passed on to every worker each interval something changed
+        self.presence = Presence()
+
+    async def share_presence(self):
+        while True:
+            await asyncio.sleep(self.presence.interval)
+            if not self.presence.changed:
+                continue
+            self.presence.changed = False
+            line = (json.dumps({"op": "presence", "nodes": self.presence.nodes}) + "\n").encode()
+            for writer in self.workers.values():
+                writer.write(line)
+
+    async def handle_worker(self, reader, writer):
+        worker = None
+        try:
+            while line := await reader.readline():
+                msg = json.loads(line)
+                op = msg["op"]
+                if op == "hello":
+                    worker = msg["worker"]
+                    self.workers[worker] = writer
+                    writer.write((json.dumps({"op": "presence", "nodes": self.presence.nodes}) + "\n").encode())
+                elif op == "presence":
+                    self.presence.report(worker, msg["count"])
+                elif op == "add":
+                    session = self.sessions[msg["sid"]] = WorkerSession(writer, msg["sid"])
+                    self.matchmaker.add_user(session)
+                elif op == "join":
+                    self.matchmaker.join(self.sessions[msg["sid"]], set(msg["interests"]), msg["from_next"])
+                elif op == "next":
+                    self.matchmaker.next(self.sessions[msg["sid"]])
+                elif op == "park":
+                    self.matchmaker.park(self.sessions[msg["sid"]])
+                elif op == "unpark":
+                    self.matchmaker.unpark(self.sessions[msg["sid"]])
+                elif op == "leave":
+                    self.leave(msg["sid"], msg["reason"])
+                elif op == "relay":
+                    target = self.workers.get(msg["to"].split(":")[0])
+                    if target:
+                        target.write((json.dumps({"op": msg["event"], "sid": msg["to"], "partner": msg["from"], "args": msg["args"]}) + "\n").encode())
+        except Exception as e:
+            log.error("broker error with worker %s: %s", worker, e)
+        finally:
+            if worker is not None:
+                log.warning("worker %s disconnected from broker", worker)
+                self.workers.pop(worker, None)
+                self.presence.forget(worker)
+                for sid in [sid for sid in self.sessions if sid.split(":")[0] == worker]:
+                    self.leave(sid)
+
+    def leave(self, sid, disconnect_reason=None):
+        session = self.sessions.pop(sid, None)
+        if session:
+            self.matchmaker.leave(session, disconnect_reason)
+
+async def run_broker(path, patience=MATCH_PATIENCE, slo=MATCH_SLO):
+    broker = Broker(patience, slo)
+    await asyncio.start_unix_server(broker.handle_worker, path)
+    asyncio.create_task(broker.share_presence())
+    log.info("broker listening on %s", path)
+    await asyncio.Event().wait()
+
+# hot restart: a new process started with the same --handover path asks the running one for its listening
+# sockets (passed as fds, so new connections never get refused) and a snapshot of the queue, pairings,
+# rate limits and chat histories. live ssh connections can't move, their keys live inside asyncssh,
+# so everyone gets parked in the new process's resume cache and ssh's back in with their token
+
+# messages per chat that move over, the tail that fills a screen. the whole log of every session would
+# be tens of megabytes of json to build while nobody gets served
+HANDOVER_HISTORY = DISPLAY_LIMIT
+# how long the old process waits for the new one to say it's up before giving up on it and carrying on
+HANDOVER_ACK_TIMEOUT = 30
+
+def snapshot_state():
+    # a queued "next" or "leave" that hasn't been handled yet would otherwise leave half a pairing behind
+    if isinstance(matchmaker, Matchmaker):
+        matchmaker.drain()
+    sessions = []
+    for session in matchmaker.active_users:
+        if not isinstance(session, ChatSession) or session.awaiting_interests:
+            continue
+        sessions.append({
+            "token": session.resume_token,
+            "art": session.art,
+            "interests": sorted(session.interests),
+            "chat_count": session.chat_count,
+            "matched": session.matched,
+            "partner": getattr(session.partner, "resume_token", None),
+            "messages": [[msg.time, msg.role, msg.text, msg.show_timestamp, msg.author is session]
+                         for msg in session.messages.recent(HANDOVER_HISTORY, False)],
+        })
+    return {"rate_limits": rate_limiter.snapshot(), "sessions": sessions}
+
+def restore_state(state):
+    rate_limiter.restore(state["rate_limits"])
+    sessions = {}
+    for data in state["sessions"]:
+        session = sessions[data["token"]] = ChatSession()
+        session.resume_token = data["token"]
+        session.art = data["art"]
+        session.interests = set(data["interests"])
+        session.chat_count = data["chat_count"]
+        session.matched = data["matched"]
+        session.awaiting_interests = False
+        for t, role, text, show_timestamp, mine in data["messages"]:
+            session.messages.append(Message(t, role, text, show_timestamp, session if mine else None))
+        session.add_message("system", "the server restarted, but your chat is still here.", show_timestamp=False)
+    for data in state["sessions"]:
+        session = sessions[data["token"]]
+        session.partner = sessions.get(data["partner"])
+        matchmaker.restore(session, session.interests, session.partner)
+        resume_cache.park(session)
+    log.info("restored %d sessions from the previous process", len(sessions))
+
+def take_over(path):
+    # (listening sockets, snapshot, connection) from whoever is serving on path, None if nobody is.
+    # blocking is fine, nothing else is running yet. the old process keeps serving until it reads
+    # "ok" from the connection, so send that once the sockets are being accepted on
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        sock.close()
+        return None
+    try:
+        sock.settimeout(HANDOVER_ACK_TIMEOUT)
+        data, fds, _, _ = socket.recv_fds(sock, 1 << 16, 16)
+        chunks = [data]
+        while chunk := sock.recv(1 << 16):
+            chunks.append(chunk)
+        return [socket.socket(fileno=fd) for fd in fds], json.loads(b"".join(chunks)), sock
+    except Exception:
+        sock.close()
+        raise
+
+class Handover:
+    def __init__(self, path, servers, stopped):
+        self.path = path
+        self.servers = servers
+        self.stopped = stopped
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        if os.path.exists(self.path):
+            os.unlink(self.path)  #the previous process's, it's on its way out
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.path)
+        listener.listen(1)
+        listener.setblocking(False)
+        log.info("a new process can take over through %s", self.path)
+        while True:
+            conn, _ = await loop.sock_accept(listener)
+            try:
+                await self.hand_over(conn)
+                break
+            except Exception as e:
+                log.error("handover failed, still serving: %s", e)
+            finally:
+                conn.close()
+        listener.close()
+
+        #the new process is accepting now, stop doing it here and send everyone over
+        for server in self.servers:
+            server.close()
+        if metrics.server:
+            metrics.server.close()
+        for session in list(matchmaker.active_users):
+            if isinstance(session, ChatSession) and session.resume_token not in resume_cache.parked:
+                session.restarting()
+        await asyncio.sleep(0.5)  #let the goodbyes drain
+        self.stopped.set()
+
+    async def hand_over(self, conn):
+        loop = asyncio.get_running_loop()
+        state = snapshot_state()
+        listeners = [sock for server in self.servers for sock in server.sockets]
+        state["metrics"] = metrics.server is not None
+        if metrics.server:
+            listeners += metrics.server.sockets
+        #the snapshot is plain lists and strings by now, so encoding it can happen off the loop
+        data = (await asyncio.to_thread(json.dumps, state)).encode()
+        sent = socket.send_fds(conn, [data], [sock.fileno() for sock in listeners])
+        await loop.sock_sendall(conn, data[sent:])
+        conn.shutdown(socket.SHUT_WR)
+        #nothing gets torn down here until the new process has restored everything and is accepting
+        ack = await asyncio.wait_for(loop.sock_recv(conn, 16), HANDOVER_ACK_TIMEOUT)
+        if ack != b"ok":
+            raise RuntimeError("the new process never said it was up")
+        log.info("handed %d listening socket(s) and %d sessions to the new process", len(listeners), len(state["sessions"]))
+
+# dead mobile connections otherwise hang around until tcp gives up, which can take ages
+KEEPALIVE_INTERVAL = 15
+KEEPALIVE_COUNT = 3
+
+# ed25519 goes first, it's the cheapest to sign every handshake with. the old rsa key still gets served
+# when it's around so people who already trust it don't get a "host key changed" scare
+HOST_KEY_PATHS = ['termegle_host_key_ed25519', 'termegle_host_key']
+
+# path -> parsed key, forked workers inherit whatever the parent already loaded
+host_keys = {}
+
+def load_host_keys(paths=HOST_KEY_PATHS):
+    keys = []
+    for i, path in enumerate(paths):
+        if path not in host_keys:
+            try:
+                host_keys[path] = asyncssh.read_private_key(path)
+                log.info("loaded %s host key from %s", host_keys[path].get_algorithm(), path)
+            except FileNotFoundError:
+                if i > 0:
+                    continue
+                #only the first one gets made up, the rest are optional extras
+                log.info("generating new ed25519 host key...")
+                host_keys[path] = asyncssh.generate_private_key('ssh-ed25519')
+                host_keys[path].write_private_key(path)
+                os.chmod(path, 0o600)
+                log.info("saved host key to %s", path)
+        keys.append(host_keys[path])
+    return keys
+
+# curve25519 kex and aead ciphers, aes-gcm for cpus with aes instructions and chacha for the ones without
+FAST_CRYPTO = {
+    "kex_algs": ["curve25519-sha256", "curve25519-sha256@libssh.org"],
+    "encryption_algs": ["aes128-gcm@openssh.com", "chacha20-poly1305@openssh.com", "aes256-gcm@openssh.com"],
+    "mac_algs": ["hmac-sha2-256-etm@openssh.com", "hmac-sha2-512-etm@openssh.com"],
+}
+
+def ssh_options(options):
+    #what both the single process server and the workers hand to create_server
+    algs = dict(FAST_CRYPTO) if options.fast_crypto else {}
+    for name, value in (("kex_algs", options.kex), ("encryption_algs", options.ciphers), ("mac_algs", options.macs)):
+        if value:
+            algs[name] = value.split(",")
+    return dict(
+        server_host_keys=load_host_keys(options.host_key or HOST_KEY_PATHS),
+        keepalive_interval=KEEPALIVE_INTERVAL,
+        keepalive_count_max=KEEPALIVE_COUNT,
+        #a stray invalid byte turns into \ufffd instead of asyncssh dropping the whole connection
+        errors="replace",
+        line_history=LINE_HISTORY,
+        max_line_length=MAX_MESSAGE_LENGTH,
+        **algs
+    )
+
+async def start_worker(worker_id, options, broker_path):
+    global matchmaker
+    configure(options)
+    matchmaker = BrokerClient(str(worker_id), broker_path)
+    resume_cache.enabled = False
+    await matchmaker.connect()
+    if options.metrics_port:
+        await metrics.serve(options.metrics_port + 1 + worker_id)
+
+    #every worker binds the same port, the kernel spreads new connections between them
+    await asyncssh.create_server(
+        TermegleServer,
+        options.host,
+        options.port,
+        reuse_port=True,
+        **ssh_options(options)
+    )
+    log.info("worker %s (pid %d) accepting connections", worker_id, os.getpid())
+    await asyncio.Event().wait()
+
+def worker_main(worker_id, options, broker_path):
+    try:
+        asyncio.run(start_worker(worker_id, options, broker_path))
+    except KeyboardInterrupt:
+        pass
+
+def broker_main(path, options):
+    setup_logging(options.log_level)
+    try:
+        asyncio.run(run_broker(path, options.match_patience, options.match_slo))
+    except KeyboardInterrupt:
+        pass
+
+def start_sharded(options):
+    setup_logging(options.log_level)
+    if options.handover:
+        log.warning("--handover only works with a single worker, ignoring it")
+    load_host_keys(options.host_key or HOST_KEY_PATHS)  #make sure they exist before the workers race to generate one
+
+    broker_path = os.path.join(tempfile.mkdtemp(prefix="termegle-"), "broker.sock")
+    broker = multiprocessing.Process(target=broker_main, args=(broker_path, options), daemon=True)
+    broker.start()
+    while not os.path.exists(broker_path):
+        if not broker.is_alive():
+            raise RuntimeError("broker failed to start")
+        time.sleep(0.05)
+
+    procs = [broker]
+    for worker_id in range(options.workers):
+        proc = multiprocessing.Process(target=worker_main, args=(worker_id, options, broker_path), daemon=True)
+        proc.start()
+        procs.append(proc)
+    #a plain kill would otherwise leave the workers running on the port without us
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    print(f"\n server is running on port {options.port} with {options.workers} workers!")
+    print("\npress ctrl+c to stop")
+    print("="*50 + "\n")
+
+    try:
+        while all(proc.is_alive() for proc in procs):
+            time.sleep(1)
+        log.error("a worker or the broker died, shutting down")
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.join()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="talk to strangers, in the terminal!")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=6767)
+    parser.add_argument("--workers", type=int, default=1, help="worker processes sharing the port, more than 1 starts a matchmaking broker too")
+    parser.add_argument("--connections-per-minute", type=int, default=5, help="per ip, raise it when load testing from one machine. split evenly between workers")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    parser.add_argument("--metrics-port", type=int, default=9767, help="serve /metrics on localhost, 0 turns it off. workers use the ports after it")
+    parser.add_argument("--match-patience", type=float, default=MATCH_PATIENCE, help="seconds someone with interests waits for a common-interest match before taking anyone, 0 = never wait")
+    parser.add_argument("--match-slo", type=float, default=MATCH_SLO, help="seconds after which a waiter gets the next person who shows up, no matter what")
+    parser.add_argument("--handover", help="unix socket path for hot restarts: start the new version with the same path and it takes over from the running one")
+    parser.add_argument("--host-key", action="append", help="host key file, repeatable. the first one is generated (ed25519) if it's missing")
+    parser.add_argument("--fast-crypto", action="store_true", help="only offer curve25519 kex and aes-gcm/chacha20 ciphers")
+    parser.add_argument("--kex", help="comma separated key exchange algorithms to allow")
+    parser.add_argument("--ciphers", help="comma separated ciphers to allow")
+    parser.add_argument("--macs", help="comma separated macs to allow")
+    return parser.parse_args(argv)
+
+def configure(options):
+    #module globals every process (including forked workers) sets up from the command line
+    global rate_limiter
+    setup_logging(options.log_level)
+    #every worker counts on its own and the kernel spreads one ip's connections across them by source
+    #port, so each one gets its share of the limit or an ip would get workers times as many
+    rate_limiter = RateLimiter(limit=max(1, math.ceil(options.connections_per_minute / options.workers)))
+    if isinstance(matchmaker, Matchmaker):
+        matchmaker.patience = options.match_patience
+        matchmaker.slo = options.match_slo
+
+async def start_server(options=None):
+    if options is None:
+        options = parse_args([])
+    configure(options)
+    port = options.port
 
-async def start_server():
     print("\n" + "="*50)
     print("  starting termegle ")
     print("="*50)
-    
-    host_key_path = 'termegle_host_key'
-    
-    try:
-        print(f"[{datetime.now()}] loading ssh host key...")
-        host_key = asyncssh.read_private_key(host_key_path)
-        print(f"[{datetime.now()}] loaded existing host key!")
-    except:
-        print(f"[{datetime.now()}] generating new ssh host key...")
-        host_key = asyncssh.generate_private_key('ssh-rsa')
-        with open(host_key_path, 'w') as f:
-            f.write(host_key.export_private_key().decode())
-        print(f"[{datetime.now()}] saved host key to {host_key_path}")
-
-    port = 6767
 
-    print(f"[{datetime.now()}] starting server on port {port}...")
+    log.info("starting server on port %d...", port)
 
     try:
-        await asyncssh.create_server(
-            TermegleServer,
-            '0.0.0.0',
-            port,
-            server_host_keys=[host_key]
-        )
+        server_options = ssh_options(options)
+        handed = take_over(options.handover) if options.handover else None
+        if handed:
+            listeners, state, handover = handed
+            restore_state(state)
+            if state["metrics"]:
+                await metrics.serve(options.metrics_port, sock=listeners.pop())
+            servers = [await asyncssh.create_server(TermegleServer, sock=sock, **server_options) for sock in listeners]
+            #the old process lets go once it hears this, if we died before here it just keeps serving
+            handover.sendall(b"ok")
+            handover.close()
+            log.info("took over from the previous process")
+        else:
+            if options.metrics_port:
+                await metrics.serve(options.metrics_port)
+            servers = [await asyncssh.create_server(
+                TermegleServer,
+                options.host,
+                port,
+                **server_options
+            )]
+
+        stopped = asyncio.Event()
+        if options.handover:
+            asyncio.create_task(Handover(options.handover, servers, stopped).serve())
 
         print(f"\n server is running on port {port}!")
         print("\nusers can connect with:")
@@ -489,7 +2278,8 @@ async def start_server():
         print("\npress ctrl+c to stop")
         print("="*50 + "\n")
 
-        await asyncio.Event().wait()
+        await stopped.wait()
+        log.info("handed over to the new process, bye")
 
     except Exception as e:
         print(f"\n error starting server: {e}")
@@ -497,8 +2287,16 @@ async def start_server():
         traceback.print_exc()
 
 if __name__ == '__main__':
+    options = parse_args()
+
     try:
-        asyncio.run(start_server())
+        if options.workers > 1:
+            print("\n" + "="*50)
+            print("  starting termegle ")
+            print("="*50)
+            start_sharded(options)
+        else:
+            asyncio.run(start_server(options))
     except KeyboardInterrupt:
         print("\n\n" + "="*50)
         print("  server stopped ")
@@ -0,0 +1,12 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from helpers import reset_state
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    reset_state(monkeypatch)
@@ -0,0 +1,138 @@
+import asyncio
+import re
+import time
+
+import asyncssh
+
+import termegle_server as ts
+
+
+def reset_state(monkeypatch):
+    # the server keeps its state in module globals, this swaps in a fresh set. needed once per
+    # asyncio.run, the matchmaker and friends start tasks on whatever loop first uses them
+    monkeypatch.setattr(ts, "matchmaker", ts.Matchmaker())
+    monkeypatch.setattr(ts, "idle_reaper", ts.IdleReaper())
+    monkeypatch.setattr(ts, "resume_cache", ts.ResumeCache())
+    monkeypatch.setattr(ts, "presence", ts.Presence(local=lambda: len(ts.matchmaker.active_users)))
+    monkeypatch.setattr(ts, "rate_limiter", ts.RateLimiter(limit=10_000))
+
+
+class FakeChannel:
+    # enough of an SSHServerChannel for a ChatSession, keeps everything written to it
+    def __init__(self, width=80, height=40, keep=True):
+        self.size = (width, height, 0, 0)
+        self.keep = keep
+        self.written = []
+        self.nbytes = 0
+        self.closed = False
+
+    def write(self, data):
+        if self.keep:
+            self.written.append(data)
+        self.nbytes += len(data.encode())
+
+    def is_closing(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+    def get_terminal_size(self):
+        return self.size
+
+    def output(self):
+        return "".join(self.written)
+
+
+async def settle(ticks=5):
+    # lets the matchmaker actor and the per-tick flushes run
+    for _ in range(ticks):
+        await asyncio.sleep(0)
+
+
+async def connect(interests="", width=80, height=40):
+    session = ts.ChatSession()
+    session.connection_made(FakeChannel(width, height))
+    session.session_started()
+    session.terminal_size_changed(width, height, 0, 0)
+    session.data_received(interests + "\r", None)
+    await settle()
+    return session
+
+
+async def pair(interests="cats", width=80, height=40):
+    a = await connect(interests, width, height)
+    b = await connect(interests, width, height)
+    assert a.partner is b and b.partner is a
+    return a, b
+
+
+HOST_KEY = asyncssh.generate_private_key("ssh-ed25519")
+ANSI = re.compile(r"\x1b(\[[0-9;?]*[A-Za-z]|[78])")
+
+
+async def start_ssh(**kwargs):
+    # a real server on a random local port, same session options as ssh_options hands out
+    if "sock" not in kwargs:
+        kwargs.update(host="127.0.0.1", port=0)
+    server = await asyncssh.create_server(
+        ts.TermegleServer,
+        server_host_keys=[HOST_KEY],
+        errors="replace",
+        line_history=ts.LINE_HISTORY,
+        max_line_length=ts.MAX_MESSAGE_LENGTH,
+        **kwargs
+    )
+    return server, server.sockets[0].getsockname()[1]
+
+
+class SSHClient:
+    # a pty client that keeps everything the server sent, escapes stripped so tests can search it
+    def __init__(self, width=80, height=40):
+        self.size = (width, height)
+        self.raw = []
+
+    async def connect(self, port, username="guest", **kwargs):
+        self.conn = await asyncssh.connect("127.0.0.1", port, known_hosts=None, username=username, **kwargs)
+        self.proc = await self.conn.create_process(term_type="xterm", term_size=self.size)
+        self.task = asyncio.create_task(self.read())
+        return self
+
+    async def read(self):
+        try:
+            while True:
+                data = await self.proc.stdout.read(65536)
+                if not data:
+                    break
+                self.raw.append(data)
+        except (asyncssh.Error, OSError):
+            pass
+
+    def text(self):
+        return ANSI.sub("", "".join(self.raw))
+
+    def send(self, line):
+        self.proc.stdin.write(line + "\r")
+
+    def mark(self):
+        return len(self.text())
+
+    async def wait_for(self, pattern, since=0, timeout=5):
+        # since: a mark() from earlier, to only look at what came after it
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            found = re.search(pattern, self.text()[since:])
+            if found:
+                return found
+            await asyncio.sleep(0.02)
+        raise AssertionError(f"never saw {pattern!r}, last output:\n{self.text()[-1000:]}")
+
+    def close(self):
+        self.conn.close()
+
+
+async def until(check, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not check():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.02)
@@ -0,0 +1,52 @@
+import asyncio
+import gc
+import time
+
+import termegle_server as ts
+from helpers import FakeChannel, reset_state, settle
+
+SESSIONS = 5000
+
+
+def connect_storm(monkeypatch, cached):
+    # everyone connecting at once: banner and interest prompt, then the first waiting screen, each flushed
+    # to the channel. returns seconds per connect and what the first session was sent
+    reset_state(monkeypatch)
+    #matching isn't what's measured here
+    monkeypatch.setattr(ts.matchmaker, "join", lambda *args, **kwargs: None)
+    if not cached:
+        #what every connect did before the cache: build the frames from scratch
+        monkeypatch.setattr(ts.FrameCache, "get", lambda self, key, build: build())
+
+    async def storm():
+        sessions = []
+        gc.collect()
+        started = time.perf_counter()
+        for n in range(SESSIONS):
+            session = ts.ChatSession()
+            session.art = n % len(ts.ASCII_ARTS)
+            session.resume_token = f"{n:024x}"
+            session.connection_made(FakeChannel(keep=n == 0))
+            session.session_started()
+            session.data_received("\r", None)
+            sessions.append(session)
+        await settle()
+        took = time.perf_counter() - started
+        return took / SESSIONS, sessions[0]._chan.output()
+
+    return asyncio.run(storm())
+
+
+def test_connect_storm_with_and_without_frame_cache(monkeypatch):
+    #best of two each, taking turns
+    uncached = cached = float("inf")
+    for _ in range(2):
+        with monkeypatch.context() as m:
+            took, uncached_output = connect_storm(m, cached=False)
+            uncached = min(uncached, took)
+        took, cached_output = connect_storm(monkeypatch, cached=True)
+        cached = min(cached, took)
+    print(f"\n{SESSIONS} connects, session_started plus first render: {uncached * 1e6:.0f}us each building the frames, "
+          f"{cached * 1e6:.0f}us with the cache")
+    assert cached_output == uncached_output
+    assert len(ts.frame_cache.frames) <= 3 * len(ts.ASCII_ARTS)
@@ -0,0 +1,146 @@
+import asyncio
+import json
+import time
+
+import termegle_server as ts
+from helpers import SSHClient, pair, reset_state, start_ssh
+
+
+def check_pairings(state):
+    partners = {data["token"]: data["partner"] for data in state["sessions"]}
+    for token, partner in partners.items():
+        if partner is not None:
+            assert partners[partner] == token
+
+
+def test_snapshot_handles_queued_events_first():
+    async def main():
+        a, b = await pair()
+        # nothing has run the matchmaker since, the "next" is still sitting in its queue
+        a.data_received("next\r", None)
+        assert b.partner is a
+        state = ts.snapshot_state()
+        check_pairings(state)
+        assert (a.partner is b) == (b.partner is a)
+        assert ts.matchmaker.events.empty()
+
+    asyncio.run(main())
+
+
+def test_chat_survives_restart(monkeypatch, tmp_path):
+    path = str(tmp_path / "handover.sock")
+
+    async def main():
+        server, port = await start_ssh()
+        stopped = asyncio.Event()
+        asyncio.create_task(ts.Handover(path, [server], stopped).serve())
+
+        a = await SSHClient().connect(port)
+        b = await SSHClient().connect(port)
+        for client in (a, b):
+            await client.wait_for("what are your interests")
+            client.send("cats")
+        for client in (a, b):
+            await client.wait_for("connected to a stranger")
+        a.send("before restart")
+        await b.wait_for("stranger: before restart")
+
+        # the new process: grab the sockets and the snapshot, start accepting, then say so. only then does
+        # the old one say goodbye and stop. (both share this process's globals here, so the restore
+        # waits until the old one is done with them)
+        listeners, state, handover = await asyncio.to_thread(ts.take_over, path)
+        servers = [(await start_ssh(sock=sock))[0] for sock in listeners]
+        await asyncio.sleep(0.2)
+        assert not stopped.is_set()
+        handover.sendall(b"ok")
+        handover.close()
+        await asyncio.wait_for(stopped.wait(), 5)
+        tokens = [(await client.wait_for(r"ssh back in as (\w+)")).group(1) for client in (a, b)]
+
+        reset_state(monkeypatch)
+        ts.restore_state(state)
+        assert set(ts.resume_cache.parked) == set(tokens)
+
+        # same port, the listening socket moved over
+        a2 = await SSHClient().connect(port, username=tokens[0])
+        await a2.wait_for("the server restarted, but your chat is still here")
+        assert "you: before restart" in a2.text()
+        b2 = await SSHClient().connect(port, username=tokens[1])
+        await b2.wait_for("welcome back! you're still talking to the same stranger")
+
+        b2.send("after restart")
+        await a2.wait_for("stranger: after restart")
+
+        # and strangers can still get in
+        c = await SSHClient().connect(port)
+        await c.wait_for("what are your interests")
+
+        for client in (a2, b2, c):
+            client.close()
+        for new in servers:
+            new.close()
+
+    asyncio.run(main())
+
+
+def test_failed_takeover_keeps_serving(tmp_path):
+    path = str(tmp_path / "handover.sock")
+
+    async def main():
+        server, port = await start_ssh()
+        stopped = asyncio.Event()
+        asyncio.create_task(ts.Handover(path, [server], stopped).serve())
+        a = await SSHClient().connect(port)
+        b = await SSHClient().connect(port)
+        for client in (a, b):
+            await client.wait_for("what are your interests")
+            client.send("cats")
+        for client in (a, b):
+            await client.wait_for("connected to a stranger")
+
+        # a new process that dies before it's up, say restore_state blew up
+        listeners, state, handover = await asyncio.to_thread(ts.take_over, path)
+        for sock in listeners:
+            sock.close()
+        handover.close()
+        await asyncio.sleep(0.2)
+        assert not stopped.is_set()
+        assert "server restarting" not in a.text()
+
+        # still chatting, still accepting, and the next attempt can still take over
+        a.send("still here")
+        await b.wait_for("stranger: still here")
+        c = await SSHClient().connect(port)
+        await c.wait_for("what are your interests")
+        listeners, state, handover = await asyncio.to_thread(ts.take_over, path)
+        assert len(state["sessions"]) == 2
+        handover.sendall(b"ok")
+        handover.close()
+        await asyncio.wait_for(stopped.wait(), 5)
+        await a.wait_for("server restarting")
+        for sock in listeners:
+            sock.close()
+
+    asyncio.run(main())
+
+
+def test_snapshot_of_long_chats():
+    # 500 sessions with full 2000 message logs, only the tail that fits a screen moves over
+    async def main():
+        for _ in range(250):
+            a, b = await pair()
+            for n in range(ts.HISTORY_LIMIT):
+                msg = ts.Message("12:00", "chat", f"message number {n} with a bit of text in it", True, a)
+                a.messages.append(msg)
+                b.messages.append(msg)
+        started = time.perf_counter()
+        state = ts.snapshot_state()
+        took = time.perf_counter() - started
+        size = len(json.dumps(state))
+        print(f"\n500 sessions x {ts.HISTORY_LIMIT} messages: snapshot {took * 1000:.0f}ms on the loop, {size / 1e6:.1f} MB of json")
+        assert len(state["sessions"]) == 500
+        assert all(len(data["messages"]) == ts.HANDOVER_HISTORY for data in state["sessions"])
+        assert state["sessions"][0]["messages"][-1][2] == f"message number {ts.HISTORY_LIMIT - 1} with a bit of text in it"
+        assert took < 1
+
+    asyncio.run(main())
@@ -0,0 +1,103 @@
+import asyncio
+
+import termegle_server as ts
+from helpers import connect, pair, settle
+
+WARNING = "you'll be disconnected in 1 minute due to inactivity."
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def use_clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ts, "idle_reaper", ts.IdleReaper(clock=clock))
+    return clock
+
+
+def advance(clock, to):
+    clock.now = 1000.0 + to
+    ts.idle_reaper.expire()
+
+
+def texts(session):
+    return [msg.text for msg in session.messages.log]
+
+
+def test_warning_then_kick(monkeypatch):
+    clock = use_clock(monkeypatch)
+
+    async def run():
+        a = await connect("cats")
+        advance(clock, ts.IDLE_WARNING - 1)
+        assert WARNING not in texts(a)
+        advance(clock, ts.IDLE_WARNING)
+        assert texts(a).count(WARNING) == 1
+        advance(clock, ts.IDLE_TIMEOUT - 1)
+        assert not a.closed and texts(a).count(WARNING) == 1
+        advance(clock, ts.IDLE_TIMEOUT)
+        assert a.closed and a._chan.closed
+        assert "inactivity timeout" in a._chan.output()
+        await settle()
+        assert a not in ts.matchmaker.active_users
+    asyncio.run(run())
+
+
+def test_activity_pushes_the_deadlines_back(monkeypatch):
+    clock = use_clock(monkeypatch)
+
+    async def run():
+        a = await connect("cats")
+        advance(clock, ts.IDLE_WARNING - 10)
+        a.data_received("anyone?\r", None)
+        advance(clock, ts.IDLE_WARNING)
+        assert WARNING not in texts(a)
+        advance(clock, ts.IDLE_WARNING * 2 - 10)
+        assert texts(a).count(WARNING) == 1
+        #typing after the warning resets it too
+        a.data_received("still here\r", None)
+        advance(clock, ts.IDLE_TIMEOUT * 2)
+        assert not a.closed
+    asyncio.run(run())
+
+
+def test_kicked_users_partner_goes_back_in_the_queue(monkeypatch):
+    clock = use_clock(monkeypatch)
+
+    async def run():
+        a, b = await pair("cats")
+        advance(clock, 100)
+        b.data_received("hello?\r", None)
+        advance(clock, ts.IDLE_TIMEOUT)
+        await settle()
+        assert a.closed and not b.closed
+        assert b.partner is None and not b.matched
+        assert "the stranger was disconnected for inactivity." in texts(b)
+        assert b in ts.matchmaker.waiting
+        #and gets whoever shows up next
+        c = await connect("cats")
+        assert b.partner is c and c.partner is b
+    asyncio.run(run())
+
+
+def test_connection_lost_cancels_the_timers(monkeypatch):
+    clock = use_clock(monkeypatch)
+    calls = []
+    monkeypatch.setattr(ts.ChatSession, "idle_warning", lambda self: calls.append("warning"))
+    monkeypatch.setattr(ts.ChatSession, "idle_kick", lambda self: calls.append("kick"))
+
+    async def run():
+        a = await connect("cats")
+        b = await connect("dogs")
+        a.connection_lost(None)
+        advance(clock, ts.IDLE_WARNING)
+        advance(clock, ts.IDLE_TIMEOUT)
+        #only b was still around to warn and kick
+        assert calls == ["warning", "kick"]
+        assert a not in ts.idle_reaper.timers and b not in ts.idle_reaper.timers
+    asyncio.run(run())
@@ -0,0 +1,86 @@
+import random
+import time
+
+import termegle_server as ts
+
+# typing, terminal junk and a few things people paste
+ALPHABET = list("abc xyz\r\n\x7f\b[AOB;0123\t‮é中\U0001f600\x00\x9b") + ["\x1b[A", "\x1bOB", "\x1b[3~", "\x1b[1;5C", "\x1bb"]
+
+
+def feed_in_pieces(buffer, stream, rng):
+    lines = []
+    i = 0
+    while i < len(stream):
+        j = i + rng.randint(1, 40)
+        lines += buffer.feed(stream[i:j])
+        i = j
+        # never more than a message plus a half arrived escape sequence
+        assert len(buffer.partial) <= buffer.limit + 16
+    return lines
+
+
+def test_fragmented_input_fuzz():
+    rng = random.Random(1)
+    for _ in range(5_000):
+        stream = "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 300)))
+        if rng.random() < 0.2:
+            stream += "x" * rng.randint(0, 3000)
+        stream += "\n"
+        limit = rng.choice([5, 50, 500])
+
+        whole = ts.LineBuffer(limit).feed(stream)
+        got = feed_in_pieces(ts.LineBuffer(limit), stream, rng)
+        for line in got:
+            assert len(line) <= limit
+            assert not ts.UNSAFE.search(line), repr(line)
+        # however it arrives it's the same lines, unless the limit cut a line and an escape or
+        # backspace straddled the cut
+        if got != whole:
+            assert max(len(line) for line in ts.LINE_END.split(stream)) > limit, (stream, got, whole)
+
+
+def test_line_editing():
+    buffer = ts.LineBuffer(10)
+    assert buffer.feed("hel") == []
+    assert buffer.feed("lo\r") == ["hello"]
+    assert buffer.feed("\nworld\n") == ["world"]
+    assert buffer.feed("ab\x7fc\x1b[") == []
+    assert buffer.feed("Ad\r\n") == ["acd"]
+    assert buffer.feed("x" * 100 + "\n") == ["x" * 10]
+    assert buffer.feed("\x1bOAq\n") == ["q"]
+    assert ts.LineBuffer().feed("‮evil\n") == ["evil"]
+
+
+def test_wrap_line():
+    rows = ts.wrap_line(ts.paint_line("34", "a" * 200), 79)
+    assert [len(text) for text, _ in rows] == [79, 79, 42]
+    assert all(painted.startswith("\033[34m") for _, painted in rows)
+    # wide characters take two columns
+    rows = ts.wrap_line(ts.paint_line("31", "中" * 50), 79)
+    assert [len(text) for text, _ in rows] == [39, 11]
+    short = ts.paint_line("31", "hi")
+    assert ts.wrap_line(short, 79)[0] is short
+
+
+def test_input_throughput():
+    data = "hello there how are you doing today\n" * 20_000
+    print()
+    for chunk in (1, 64, 4096, len(data)):
+        buffer = ts.LineBuffer()
+        lines = 0
+        started = time.perf_counter()
+        for i in range(0, len(data), chunk):
+            lines += len(buffer.feed(data[i:i + chunk]))
+        took = time.perf_counter() - started
+        assert lines == 20_000
+        print(f"{chunk:>7} char chunks: {len(data) / took / 1e6:.1f} MB/s, {lines / took / 1e3:.0f}k lines/s")
+
+    # someone pasting a novel with no newline in it costs a message worth of memory, and stays linear
+    buffer = ts.LineBuffer()
+    started = time.perf_counter()
+    for i in range(0, 10_000_000, 65536):
+        buffer.feed("x" * 65536)
+    took = time.perf_counter() - started
+    print(f"10MB with no newline: {took:.3f}s, {len(buffer.partial)} chars held")
+    assert len(buffer.partial) == ts.MAX_MESSAGE_LENGTH
+    assert took < 5
@@ -0,0 +1,79 @@
+import asyncio
+import random
+import time
+
+import termegle_server as ts
+
+USERS = 500
+ARRIVALS = 800  # per second, on a clock shrunk like test_wait_times
+# 150 topics with zipf popularity, each typed a few different ways
+TOPICS = ["cat", "dog", "video game", "movie", "book", "coding", "anime", "music", "sport", "hobby"] + [f"topic{n}" for n in range(140)]
+WEIGHTS = [1 / (n + 1) for n in range(len(TOPICS))]
+
+
+def spellings(topic):
+    return [topic, topic + "s", topic.upper(), topic.replace(" ", "")]
+
+
+class User:
+    def __init__(self, interests, stats):
+        self.interests = interests
+        self.stats = stats
+        self.partner = None
+        self.since = time.monotonic()
+
+    def paired(self, partner, common, joined=False):
+        self.partner = partner
+        self.stats["waits"].append(time.monotonic() - self.since)
+        if joined:
+            self.stats["shared"].append(len(common))
+            #what plain string intersection would have made of the same pair
+            self.stats["exact"].append(bool(self.interests & partner.interests))
+
+    def peer_left(self, partner, reason=None):
+        self.partner = None
+        self.since = time.monotonic()
+
+    def queue_status(self, position, estimate):
+        pass
+
+
+async def simulate(patience, seed=1):
+    rng = random.Random(seed)
+    mm = ts.Matchmaker(patience, ts.MATCH_SLO / 100)
+    stats = {"waits": [], "shared": [], "exact": []}
+
+    async def visit():
+        picked = rng.choices(TOPICS, WEIGHTS, k=rng.randint(0, 3))
+        user = User({rng.choice(spellings(topic)) for topic in picked}, stats)
+        mm.add_user(user)
+        mm.join(user, user.interests)
+        await asyncio.sleep(rng.expovariate(1 / 0.3))
+        mm.leave(user)
+
+    visits = []
+    for _ in range(USERS):
+        visits.append(asyncio.create_task(visit()))
+        await asyncio.sleep(rng.expovariate(ARRIVALS))
+    await asyncio.gather(*visits)
+    mm.task.cancel()
+    return stats
+
+
+def test_match_quality_against_waiting():
+    print()
+    quality = []
+    for patience in (0, 0.02, 0.1):
+        stats = asyncio.run(simulate(patience))
+        waits = sorted(stats["waits"])
+        matches = len(stats["shared"])
+        common = sum(1 for shared in stats["shared"] if shared) / matches
+        exact = sum(stats["exact"]) / matches
+        quality.append(common)
+        print(f"patience {patience * 100:>4.0f}s: {matches} matches, {common:.0%} share an interest "
+              f"({exact:.0%} by exact text), {sum(stats['shared']) / matches:.2f} shared on average, "
+              f"wait p50 {waits[len(waits) // 2] * 100:.1f}s p99 {waits[int(len(waits) * 0.99)] * 100:.1f}s")
+        # normalizing finds everything plain intersection would have, and then some
+        assert common >= exact
+    # holding out longer buys better matches
+    assert quality[0] < quality[-1]
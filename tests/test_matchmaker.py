@@ -0,0 +1,131 @@
+import asyncio
+import random
+import time
+
+import termegle_server as ts
+from helpers import connect, settle
+
+NAMES = ["gaming", "music", "cats", "coding", "movies", "anime", "sports", "reading"]
+
+
+class Session:
+    def __init__(self, n):
+        self.n = n
+
+    def __repr__(self):
+        return f"s{self.n}"
+
+
+def old_find_match(waiting, interests, from_next):
+    # the three passes find_match used to make over the whole queue.
+    # waiting is [(session, interests, from_next)], oldest first. returns (partner, common, tier)
+    if from_next:
+        for i, (partner, partner_interests, partner_next) in enumerate(waiting):
+            if not partner_next:
+                del waiting[i]
+                return partner, interests & partner_interests, "next"
+    for i, (partner, partner_interests, partner_next) in enumerate(waiting):
+        if interests & partner_interests:
+            del waiting[i]
+            return partner, interests & partner_interests, "interests"
+    if waiting:
+        partner, partner_interests, _ = waiting.pop(0)
+        return partner, interests & partner_interests, "fifo"
+    return None, set(), None
+
+
+def run_queue(seed, max_interests, steps=3000):
+    # random joins, "next" joins and leaves against both. patience 0 and no slo is how matching worked before
+    # those existed, so the two should agree on every step
+    rng = random.Random(seed)
+    mm = ts.Matchmaker(patience=0, slo=float("inf"))
+    waiting = []
+    results = []
+    for n in range(steps):
+        if waiting and rng.random() < 0.2:
+            session, _, _ = waiting.pop(rng.randrange(len(waiting)))
+            mm.dequeue(session)
+            continue
+        session = Session(n)
+        interests = set(rng.sample(NAMES, rng.randint(0, max_interests)))
+        from_next = rng.random() < 0.3
+        partner, common = mm.find_match(session, mm.tags.tags(interests), from_next)
+        expected = old_find_match(waiting, interests, from_next)
+        if expected[0] is None:
+            waiting.append((session, interests, from_next))
+        results.append((session, interests, partner, common, expected))
+        assert list(mm.waiting) == [entry[0] for entry in waiting]
+    return results
+
+
+def test_same_matches_as_the_old_scan_with_one_interest_each():
+    for seed in range(5):
+        for session, interests, partner, common, (old_partner, old_common, tier) in run_queue(seed, 1):
+            assert partner is old_partner, (seed, session, tier)
+            assert common == old_common
+
+
+def test_same_priorities_as_the_old_scan_with_several_interests():
+    # with overlapping tag sets the index ranks by idf instead of taking the oldest common waiter,
+    # so only the interest tier may pick someone else, and it still has to share an interest
+    for seed in range(5):
+        for session, interests, partner, common, (old_partner, old_common, tier) in run_queue(seed, 4):
+            assert (partner is None) == (old_partner is None)
+            if tier == "interests":
+                assert common
+            else:
+                assert partner is old_partner, (seed, session, tier)
+                assert common == old_common
+
+
+def test_deep_queue_stays_cheap():
+    # 20k waiters holding out for a tag nobody else has. the old scan looked at all of them for every
+    # join, 10k joins through the index take well under a second
+    mm = ts.Matchmaker(patience=5, slo=float("inf"))
+    for n in range(20_000):
+        mm.find_match(Session(n), mm.tags.tags({f"lonely {n}"}), False)
+    started = time.perf_counter()
+    for n in range(5_000):
+        mm.find_match(Session(("a", n)), mm.tags.tags({"needle"}), False)
+        partner, common = mm.find_match(Session(("b", n)), mm.tags.tags({"needle"}), False)
+        assert partner.n == ("a", n) and common == {"needle"}
+    assert time.perf_counter() - started < 2
+    assert len(mm.waiting) == 20_000
+
+
+def test_pairings_stay_mutual_through_a_next_and_disconnect_storm():
+    # thousands of random connects, "next"s, messages and dropped connections through the matchmaker actor.
+    # whenever it's caught up, everyone has zero or one partner and it's the same pairing from both ends
+    rng = random.Random(11)
+
+    def check(alive):
+        partners = ts.matchmaker.partners
+        for session, partner in partners.items():
+            assert partners[partner] is session
+            assert session in alive and partner in alive
+        for session in alive:
+            assert session.partner is partners.get(session)
+            assert session.matched == (session.partner is not None)
+            assert session not in ts.matchmaker.waiting or session not in partners
+
+    async def run():
+        alive = []
+        for step in range(5000):
+            roll = rng.random()
+            if roll < 0.3 or len(alive) < 2:
+                alive.append(await connect(rng.choice(["", "cats", "dogs", "cats, dogs"])))
+            elif roll < 0.6:
+                rng.choice(alive).data_received("next\r", None)
+            elif roll < 0.8:
+                session = alive.pop(rng.randrange(len(alive)))
+                session.connection_lost(None)
+            else:
+                rng.choice(alive).data_received("hey\r", None)
+            if step % 50 == 0:
+                await settle(20)
+                check(alive)
+        await settle(20)
+        check(alive)
+        assert ts.matchmaker.active_users == set(alive)
+
+    asyncio.run(run())
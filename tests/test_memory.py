@@ -0,0 +1,39 @@
+import asyncio
+import gc
+import tracemalloc
+
+import termegle_server as ts
+from helpers import FakeChannel, settle
+
+USERS = 10_000
+
+
+def test_idle_session_footprint():
+    # 10k people who connect, type their interests, get paired or queued and then never say anything.
+    # measures what the server holds per session (the ssh side isn't part of it)
+    async def run():
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        sessions = []
+        for n in range(USERS):
+            session = ts.ChatSession()
+            session.connection_made(FakeChannel(keep=False))
+            session.session_started()
+            session.terminal_size_changed(80, 40, 0, 0)
+            session.data_received(f"interest {n % 50}\r", None)
+            sessions.append(session)
+            if n % 500 == 0:
+                await settle()
+        await settle(20)
+        gc.collect()
+        used = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        per_session = used / USERS
+        paired = sum(1 for session in sessions if session.partner is not None)
+        print(f"\n{USERS} idle sessions ({paired} paired): {used / 1e6:.1f} MB, {per_session / 1024:.1f} KiB each")
+        assert len(ts.matchmaker.active_users) == USERS
+        assert per_session < 16 * 1024
+        for session in sessions:
+            assert len(session.messages) < 20
+    asyncio.run(run())
@@ -0,0 +1,79 @@
+import asyncio
+import logging
+
+import termegle_server as ts
+from helpers import pair, settle
+
+
+async def scrape(port, path="/metrics"):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+    response = (await reader.read()).decode()
+    writer.close()
+    head, body = response.split("\r\n\r\n", 1)
+    return head.split("\r\n")[0], body
+
+
+def test_scrape_has_counters_and_histograms(monkeypatch):
+    monkeypatch.setattr(ts, "metrics", ts.Metrics())
+
+    async def main():
+        await ts.metrics.serve(0)
+        port = ts.metrics.server.sockets[0].getsockname()[1]
+        a, b = await pair()
+        for n in range(3):
+            a.data_received(f"hello {n}\r", None)
+        await settle()
+
+        status, body = await scrape(port)
+        assert status == "HTTP/1.1 200 OK"
+        lines = body.splitlines()
+        assert "# TYPE termegle_messages_total counter" in lines
+        assert "termegle_messages_total 3.0" in lines
+        assert 'termegle_matches_total{tier="interests"} 1.0' in lines
+        assert "# TYPE termegle_match_wait_seconds histogram" in lines
+        buckets = [line for line in lines if line.startswith('termegle_match_wait_seconds_bucket{tier="interests"')]
+        assert len(buckets) == len(ts.metrics.match_wait.buckets) + 1
+        assert buckets[-1] == 'termegle_match_wait_seconds_bucket{tier="interests",le="+Inf"} 1'
+        assert 'termegle_match_wait_seconds_count{tier="interests"} 1' in lines
+        # buckets are cumulative
+        counts = [int(line.split()[-1]) for line in buckets]
+        assert counts == sorted(counts)
+
+        assert (await scrape(port, "/"))[0] == "HTTP/1.1 404 Not Found"
+        ts.metrics.server.close()
+
+    asyncio.run(main())
+
+
+def test_scrape_that_never_finishes_is_dropped(monkeypatch):
+    monkeypatch.setattr(ts, "metrics", ts.Metrics())
+    monkeypatch.setattr(ts, "SCRAPE_TIMEOUT", 0.1)
+
+    async def main():
+        await ts.metrics.serve(0)
+        port = ts.metrics.server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET /metrics HTTP/1.1\r\n")  #and then nothing
+        assert await asyncio.wait_for(reader.read(), 2) == b""
+        writer.close()
+        ts.metrics.server.close()
+
+    asyncio.run(main())
+
+
+def test_worker_flushes_its_log_before_exiting(monkeypatch, capfd):
+    monkeypatch.setattr(logging.getLogger(), "handlers", [])
+    monkeypatch.setattr(ts.os, "_exit", lambda code: None)
+    ts.setup_logging()
+    assert ts.log_listener._thread is not None
+
+    async def main():
+        reader = asyncio.StreamReader()
+        reader.feed_eof()
+        await ts.BrokerClient("7", "/nonexistent").listen(reader)
+
+    asyncio.run(main())
+    # the listener thread was stopped, which only returns once the queue is empty
+    assert ts.log_listener._thread is None
+    assert "worker 7 exiting" in capfd.readouterr().err
@@ -0,0 +1,68 @@
+import asyncio
+
+import termegle_server as ts
+from helpers import pair, settle
+
+
+def test_one_channel_write_per_tick():
+    async def run():
+        a, b = await pair()
+        writes = len(a._chan.written)
+        for i in range(5):
+            b.data_received(f"hello {i}\r", None)
+        await settle(1)
+        #five renders and five messages, one write
+        assert len(a._chan.written) == writes + 1
+    asyncio.run(run())
+
+
+def test_frames_collapse_while_paused():
+    async def run():
+        a, b = await pair()
+        a.pause_writing()
+        written = a._chan.nbytes
+        for i in range(8):
+            b.data_received(f"while you were away {i}\r", None)
+        await settle()
+        assert a._chan.nbytes == written and a.bytes_buffered == 0
+        assert a.render_pending and a.frames_dropped == 7
+        a.resume_writing()
+        await settle()
+        #one full repaint with everything in it
+        assert "while you were away 7" in a._chan.output()[-2000:]
+    asyncio.run(run())
+
+
+def test_buffer_is_capped_for_a_client_that_never_reads():
+    async def run():
+        a, b = await pair()
+        for i in range(20):
+            a.data_received(f"line {i}\r", None)
+        await settle()
+        a.pause_writing()
+        for _ in range(2000):
+            a.data_received("save\r", None)
+            a.data_received("back\r", None)
+            b.data_received("still there?\r", None)
+            assert a.bytes_buffered <= ts.OUTPUT_LIMIT
+            assert len(a.outbuf) < 10_000
+            if a.closed:
+                break
+        await settle()
+        #cut off instead of buffering forever
+        assert a.closed and a._chan.closed
+        assert not a.outbuf
+    asyncio.run(run())
+
+
+def test_paused_save_mode_does_not_queue_the_chat_frame():
+    async def run():
+        a, b = await pair()
+        a.pause_writing()
+        b.data_received("hi\r", None)
+        assert a.render_pending
+        a.data_received("save\r", None)
+        #the pending chat frame would just be painted over by the log
+        assert not a.render_pending and a.screen is None
+        assert "stranger: hi" not in "".join(a.outbuf)
+    asyncio.run(run())
@@ -0,0 +1,134 @@
+import asyncio
+import random
+import time
+
+import termegle_server as ts
+from helpers import connect, pair, settle
+
+INTERVAL = 0.1
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Stranger:
+    pass
+
+
+def test_total_is_cached_between_intervals():
+    clock = Clock()
+    users = [1] * 3
+    recounts = 0
+
+    def local():
+        nonlocal recounts
+        recounts += 1
+        return len(users)
+
+    presence = ts.Presence(local=local, interval=2, clock=clock)
+    presence.report("other", 4)
+    assert presence.online_count() == 7
+    users.append(1)
+    presence.report("other", 5)
+    for _ in range(100_000):
+        assert presence.online_count() == 7
+    assert recounts == 1
+    clock.now = 2
+    assert presence.online_count() == 9
+    assert recounts == 2
+
+
+def test_nodes_converge_within_two_intervals(monkeypatch, tmp_path):
+    # a broker and five workers in one process, everyone's count should catch up with the truth
+    # within one report plus one share
+    monkeypatch.setattr(ts.os, "_exit", lambda code: None)
+    path = str(tmp_path / "broker.sock")
+
+    async def main():
+        broker = ts.Broker()
+        broker.presence.interval = INTERVAL
+        server = await asyncio.start_unix_server(broker.handle_worker, path)
+        sharing = asyncio.create_task(broker.share_presence())
+        workers = []
+        for n in range(5):
+            worker = ts.BrokerClient(str(n), path)
+            worker.presence = ts.Presence(local=lambda worker=worker: len(worker.active_users), interval=INTERVAL)
+            await worker.connect()
+            workers.append(worker)
+
+        rng = random.Random(3)
+        slowest = 0
+        for _ in range(10):
+            for _ in range(rng.randint(1, 40)):
+                worker = rng.choice(workers)
+                if worker.active_users and rng.random() < 0.4:
+                    worker.leave(rng.choice(list(worker.active_users)))
+                else:
+                    worker.add_user(Stranger())
+            truth = sum(len(worker.active_users) for worker in workers)
+            changed = time.monotonic()
+            while [worker.presence.online_count() for worker in workers] != [truth] * len(workers):
+                assert time.monotonic() - changed < 2 * INTERVAL + 0.1
+                await asyncio.sleep(0.01)
+            slowest = max(slowest, time.monotonic() - changed)
+        print(f"\n5 nodes, 10 rounds of churn: all agreed within {slowest * 1000:.0f}ms "
+              f"(staleness window {2 * INTERVAL * 1000:.0f}ms)")
+
+        # a worker that goes away drops out of everyone else's count
+        gone = workers.pop()
+        gone.writer.close()
+        await asyncio.sleep(2 * INTERVAL + 0.1)
+        truth = sum(len(worker.active_users) for worker in workers)
+        assert [worker.presence.online_count() for worker in workers] == [truth] * len(workers)
+
+        for worker in workers:
+            worker.writer.close()
+        sharing.cancel()
+        server.close()
+
+    asyncio.run(main())
+
+
+def test_waiting_screen_gets_the_new_count():
+    async def main():
+        a = await connect()
+        assert a in ts.presence.watchers
+        b = Stranger()
+        ts.matchmaker.active_users.add(b)
+        a._chan.written.clear()
+        ts.presence.refresh()
+        await settle()
+        assert "2 users online right now" in a._chan.output()
+        a.connection_lost(None)
+        assert a not in ts.presence.watchers
+
+    asyncio.run(main())
+
+
+def test_parked_sessions_stop_watching():
+    async def main():
+        a, b = await pair()
+        a._chan.closed = True
+        a.connection_lost(ConnectionResetError())
+        await settle()
+        assert a.resume_token in ts.resume_cache.parked
+        # the partner moving on repaints a's waiting screen, with nobody there to see it
+        b.data_received("next\r", None)
+        await settle()
+        assert a.partner is None
+        assert a not in ts.presence.watchers
+
+        # same for a session restored from a handover, it has no channel until its user is back
+        restored = ts.ChatSession()
+        restored.awaiting_interests = False
+        restored.add_message("system", ts.online_text(1), show_timestamp=False)
+        restored.render()
+        await settle()
+        assert restored not in ts.presence.watchers
+
+    asyncio.run(main())
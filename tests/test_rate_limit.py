@@ -0,0 +1,86 @@
+import asyncio
+import time
+
+import termegle_server as ts
+from helpers import pair
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_burst_then_refill():
+    clock = Clock()
+    limiter = ts.RateLimiter(limit=5, period=60, clock=clock)
+    assert all(limiter.check_rate_limit("10.0.0.1") for _ in range(5))
+    assert not limiter.check_rate_limit("10.0.0.1")
+    assert limiter.check_rate_limit("10.0.0.2")
+    clock.now = 12  #one token back every 60 / 5 seconds
+    assert limiter.check_rate_limit("10.0.0.1")
+    assert not limiter.check_rate_limit("10.0.0.1")
+
+
+def test_prefix_aggregation():
+    limiter = ts.RateLimiter(limit=2, ipv4_prefix=24, ipv6_prefix=64, clock=Clock())
+    assert limiter.check_rate_limit("192.0.2.1") and limiter.check_rate_limit("192.0.2.200")
+    assert not limiter.check_rate_limit("192.0.2.77")
+    assert limiter.check_rate_limit("192.0.3.1")
+    assert limiter.check_rate_limit("2001:db8::1") and limiter.check_rate_limit("2001:db8::ffff:1")
+    assert not limiter.check_rate_limit("2001:db8::42")
+    assert limiter.check_rate_limit("2001:db8:0:1::1")
+    #ipv4 mapped addresses count as the ipv4 address
+    assert not limiter.check_rate_limit("::ffff:192.0.2.9")
+
+
+def test_full_table_still_limits_keys_it_has():
+    limiter = ts.RateLimiter(limit=1, max_keys=3, clock=Clock())
+    ips = ["10.0.0.1", "10.0.0.2", "10.0.0.3"]
+    assert all(limiter.check_rate_limit(ip) for ip in ips)
+    assert not any(limiter.check_rate_limit(ip) for ip in ips * 3)
+
+
+def test_memory_stays_bounded_under_a_scan():
+    clock = Clock()
+    limiter = ts.RateLimiter(limit=5, period=60, max_keys=1000, clock=clock)
+    for n in range(50_000):
+        clock.now = n * 0.001
+        limiter.check_rate_limit(f"10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}")
+        assert len(limiter.connections) <= 1000
+    #idle keys go once their bucket would be full again anyway
+    clock.now = 1000
+    limiter.check_rate_limit("10.9.9.9")
+    assert len(limiter.connections) == 1
+
+
+def test_chat_line_limit(monkeypatch):
+    async def run():
+        a, b = await pair()
+        for i in range(ts.MESSAGE_BURST + 3):
+            a.data_received(f"spam {i}\r", None)
+        got = [msg.text for msg in b.messages.log if msg.role == "chat"]
+        assert got == [f"spam {i}" for i in range(ts.MESSAGE_BURST)]
+        assert "slow down! that message wasn't sent." in [msg.text for msg in a.messages.log]
+    asyncio.run(run())
+
+
+def test_million_checks_across_100k_ips():
+    # the microbenchmark: 1M connection checks spread over 100k addresses, a microsecond apart
+    clock = Clock()
+    limiter = ts.RateLimiter(limit=5, period=60, clock=clock)
+    ips = [f"10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}" for n in range(100_000)]
+    allowed = 0
+    started = time.perf_counter()
+    for n in range(1_000_000):
+        clock.now = n * 1e-6
+        allowed += limiter.check_rate_limit(ips[(n * 7919) % 100_000])
+    took = time.perf_counter() - started
+    print(f"\n1M checks over 100k ips: {took:.2f}s, {1_000_000 / took / 1e3:.0f}k checks/s, "
+          f"{len(limiter.connections)} keys held, {allowed} allowed")
+    #every address gets exactly its burst of 5, even with the table exactly full
+    assert allowed == 500_000
+    assert len(limiter.connections) == 100_000
+    assert took < 10
@@ -0,0 +1,40 @@
+import asyncio
+import time
+
+import termegle_server as ts
+from helpers import pair, settle
+
+PAIRS = 1000
+ROUNDS = 20
+
+
+def test_relay_throughput_with_1k_pairs(monkeypatch):
+    monkeypatch.setattr(ts, "MESSAGE_RATE", 1e9)
+    monkeypatch.setattr(ts, "MESSAGE_BURST", 1e9)
+
+    async def main():
+        pairs = [await pair() for _ in range(PAIRS)]
+        for a, b in pairs:
+            for session in (a, b):
+                session._chan.keep = False
+        await settle()
+        for a, b in pairs:
+            a._chan.nbytes = b._chan.nbytes = 0
+
+        started = time.perf_counter()
+        for n in range(ROUNDS):
+            for a, b in pairs:
+                (a if n % 2 else b).data_received(f"hello there number {n}\r", None)
+            await asyncio.sleep(0)  #the per tick flush
+        took = time.perf_counter() - started
+        sent = sum(session._chan.nbytes for a, b in pairs for session in (a, b))
+        print(f"\n{PAIRS} pairs: {ROUNDS * PAIRS / took:,.0f} messages/s relayed, "
+              f"{sent / (ROUNDS * PAIRS):.0f} bytes written per message")
+
+        # one Message per line, both histories hold the same object
+        for a, b in pairs:
+            assert a.messages.log[-1] is b.messages.log[-1]
+            assert a.messages.log[-1].text == f"hello there number {ROUNDS - 1}"
+        assert took < 10
+
+    asyncio.run(main())
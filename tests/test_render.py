@@ -0,0 +1,45 @@
+import asyncio
+
+import pytest
+
+import termegle_server as ts
+from helpers import pair, reset_state, settle
+
+
+def scripted_chat(monkeypatch, diff, messages=200):
+    # two people trading 200 lines, every 7th one long enough to wrap. returns the bytes each side
+    # was sent for the chat part and what their terminals ended up showing
+    pyte = pytest.importorskip("pyte")
+    reset_state(monkeypatch)
+    monkeypatch.setattr(ts, "MESSAGE_RATE", 1e9)
+    monkeypatch.setattr(ts, "MESSAGE_BURST", 1e9)
+    if not diff:
+        #what render did before the diff renderer: a full repaint every time
+        monkeypatch.setattr(ts.ChatSession, "screen_update", lambda self, old, new: None)
+
+    async def chat():
+        a, b = await pair()
+        before = (a._chan.nbytes, b._chan.nbytes)
+        for i in range(messages):
+            text = f"message number {i}" + (" and then some" * 8 if i % 7 == 0 else "")
+            (a if i % 3 else b).data_received(text + "\r", None)
+            await settle(2)
+        screens = []
+        for session in (a, b):
+            screen = pyte.Screen(80, 40)
+            pyte.Stream(screen).feed(session._chan.output())
+            screens.append([line.rstrip() for line in screen.display])
+        return (a._chan.nbytes - before[0], b._chan.nbytes - before[1]), screens
+
+    return asyncio.run(chat())
+
+
+def test_diff_renderer_bytes_against_full_repaints(monkeypatch):
+    with monkeypatch.context() as m:
+        full_bytes, full_screens = scripted_chat(m, diff=False)
+    diff_bytes, diff_screens = scripted_chat(monkeypatch, diff=True)
+    print(f"\n200 message chat, bytes sent (you, stranger): full repaints {full_bytes}, diff {diff_bytes}, "
+          f"{sum(full_bytes) / sum(diff_bytes):.1f}x less")
+    #same picture on both terminals, for a fraction of the bytes
+    assert diff_screens == full_screens
+    assert sum(diff_bytes) * 4 < sum(full_bytes)
@@ -0,0 +1,129 @@
+import asyncio
+
+import termegle_server as ts
+from helpers import SSHClient, pair, settle, start_ssh, until
+
+
+async def chatting_pair(port):
+    a = await SSHClient().connect(port)
+    b = await SSHClient().connect(port)
+    for client in (a, b):
+        await client.wait_for("what are your interests")
+        client.send("cats")
+    for client in (a, b):
+        await client.wait_for("connected to a stranger")
+    return a, b
+
+
+def test_dropped_connection_comes_back():
+    async def main():
+        server, port = await start_ssh()
+        a, b = await chatting_pair(port)
+        token = (await a.wait_for(r"ssh in as (\w+)")).group(1)
+        assert len(token) == 24
+
+        a.send("hello from a")
+        await b.wait_for("stranger: hello from a")
+
+        a.conn.abort()
+        await until(lambda: token in ts.resume_cache.parked)
+        await b.wait_for("giving them 2 min to come back")
+        b.send("are you there")
+
+        # a made up name doesn't get anyone's chat, just a fresh session
+        guess = await SSHClient().connect(port, username=token[:8])
+        await guess.wait_for("what are your interests")
+        assert token in ts.resume_cache.parked
+        guess.close()
+
+        a2 = await SSHClient().connect(port, username=token)
+        await a2.wait_for("welcome back! you're still talking to the same stranger")
+        # the history survived, including what was said while a was gone
+        text = a2.text()
+        assert "you: hello from a" in text and "stranger: are you there" in text
+        assert token not in ts.resume_cache.parked
+        await b.wait_for("the stranger is back!")
+
+        a2.send("back again")
+        await b.wait_for("stranger: back again")
+        b.send("welcome")
+        await a2.wait_for("stranger: welcome")
+
+        a2.close()
+        b.close()
+        server.close()
+
+    asyncio.run(main())
+
+
+def test_partner_requeued_when_nobody_comes_back():
+    async def main():
+        server, port = await start_ssh()
+        ts.resume_cache.grace = 0.3
+        a, b = await chatting_pair(port)
+        token = (await a.wait_for(r"ssh in as (\w+)")).group(1)
+
+        a.conn.abort()
+        await b.wait_for("the stranger's connection dropped.")
+        await until(lambda: not ts.resume_cache.parked)
+        assert not ts.matchmaker.away
+        seen = b.mark()
+
+        # too late, the token is just a username now
+        a2 = await SSHClient().connect(port, username=token)
+        await a2.wait_for("what are your interests")
+        a2.send("cats")
+        await a2.wait_for("connected to a stranger")
+        await b.wait_for("connected to a stranger", since=seen)
+
+        a2.close()
+        b.close()
+        server.close()
+
+    asyncio.run(main())
+
+
+def test_reconnect_before_the_drop_is_noticed():
+    # a phone switching networks: the old connection is still open as far as the server knows
+    async def main():
+        server, port = await start_ssh()
+        a, b = await chatting_pair(port)
+        token = (await a.wait_for(r"ssh in as (\w+)")).group(1)
+        a.send("hello from a")
+        await b.wait_for("stranger: hello from a")
+        session = ts.resume_cache.live[token]
+
+        a2 = await SSHClient().connect(port, username=token)
+        await a2.wait_for("welcome back! you're still talking to the same stranger")
+        assert "you: hello from a" in a2.text()
+        # the old connection got cut, without parking anything or telling b it dropped
+        await asyncio.wait_for(a.task, 5)
+        await asyncio.sleep(0.1)
+        assert not ts.resume_cache.parked and not ts.matchmaker.away
+        assert ts.resume_cache.live[token] is session and session.replaced == 0
+        assert "connection dropped" not in b.text()
+
+        a2.send("still here")
+        await b.wait_for("stranger: still here")
+        b.send("nice")
+        await a2.wait_for("stranger: nice")
+
+        a2.close()
+        b.close()
+        server.close()
+
+    asyncio.run(main())
+
+
+def test_no_resume_across_workers():
+    # --workers: a reconnect could land on any worker, so there's no token to hand out or chat to hold
+    async def main():
+        ts.resume_cache.enabled = False
+        a, b = await pair()
+        assert not any("ssh in as" in msg.text for msg in a.messages.log)
+        a.connection_lost(ConnectionResetError())
+        await settle()
+        assert not ts.resume_cache.parked
+        assert b.partner is None and b in ts.matchmaker.waiting
+
+    asyncio.run(main())
@@ -0,0 +1,155 @@
+import asyncio
+import base64
+import re
+
+import termegle_server as ts
+from helpers import pair, settle
+
+PAGE = re.compile(r"chat log page (\d+) - messages (\d+)-(\d+) of (\d+)")
+
+
+def chatter(a, b, count):
+    for n in range(count):
+        msg = ts.Message("[12:00]", "chat", f"line {n}", True, a if n % 2 else b)
+        a.messages.append(msg)
+        b.messages.append(msg)
+
+
+def count_sends(monkeypatch, session):
+    # how many writes pump pushes out, reset by the test between ticks
+    sent = [0]
+    send = session.send
+
+    def counting(data, frame=False):
+        sent[0] += 1
+        send(data, frame)
+
+    monkeypatch.setattr(session, "send", counting)
+    return sent
+
+
+def test_save_streams_a_chunk_per_tick_and_waits_while_paused(monkeypatch):
+    async def main():
+        a, b = await pair()
+        chatter(a, b, 1000)
+        sent = count_sends(monkeypatch, a)
+        a.data_received("save\r", None)
+        ticks = 0
+        while a.streaming is not None:
+            assert sent[0] <= ts.STREAM_CHUNK + 8  #the header goes out with the first chunk
+            sent[0] = 0
+            ticks += 1
+            if ticks == 3:
+                # client stopped reading: nothing more goes out however long it takes
+                a.pause_writing()
+                written = len(a._chan.output())
+                await settle(20)
+                assert len(a._chan.output()) == written and a.streaming is not None
+                a.resume_writing()
+                sent[0] = 0  #resume_writing pushes a chunk itself, the next tick is a fresh one
+            await asyncio.sleep(0)
+        await settle()
+        assert ticks >= 1000 // ts.STREAM_CHUNK - 1  #one chunk went out from resume_writing
+        out = a._chan.output()
+        lines = [f"[12:00] [{'YOU' if n % 2 else 'STRANGER'}] line {n}\r\n" for n in range(1000)]
+        start = out.index("TERMEGLE CHAT LOG")
+        positions = [out.index(line, start) for line in lines]
+        assert positions == sorted(positions)
+        assert out.endswith(ts.SAVE_COMMANDS_LINE + "\r\n> ")
+
+    asyncio.run(main())
+
+
+def test_save_then_copy_in_one_tick_keeps_one_pump(monkeypatch):
+    async def main():
+        a, b = await pair()
+        chatter(a, b, 1000)
+        a.data_received("save\r", None)
+        sent = count_sends(monkeypatch, a)
+        a.data_received("copy\r", None)
+        while a.streaming is not None:
+            assert sent[0] <= ts.STREAM_CHUNK + 1
+            sent[0] = 0
+            await asyncio.sleep(0)
+
+    asyncio.run(main())
+
+
+def osc52_payload(out):
+    start = out.index("\033]52;c;") + len("\033]52;c;")
+    end = out.index("\a", start)
+    return out[start:end]
+
+
+def test_copy_puts_the_transcript_on_the_clipboard():
+    async def main():
+        a, b = await pair()
+        chatter(a, b, 500)
+        a.data_received("save\r", None)
+        await settle(50)
+        a._chan.written.clear()
+        #the copy is of the log as it stood when it was asked for
+        expected = "".join(ts.transcript_line(msg, a) for msg in a.messages.snapshot())
+        a.data_received("copy\r", None)
+        # typed while the copy is still going out, the reprompt waits for the sequence to close
+        a.data_received("huh\r", None)
+        b.data_received("hello again\r", None)
+        await settle(50)
+        out = a._chan.output()
+        payload = osc52_payload(out)
+        assert base64.b64decode(payload).decode() == expected
+        assert ts.SAVE_COMMANDS_LINE in out[out.index("\a"):]
+        assert "sent the log to your clipboard" in out
+
+    asyncio.run(main())
+
+
+def test_cutting_a_copy_short_closes_the_sequence():
+    async def main():
+        a, b = await pair()
+        chatter(a, b, 1000)
+        a.data_received("save\r", None)
+        await settle(50)
+        a._chan.written.clear()
+        a.data_received("copy\r", None)
+        await asyncio.sleep(0)
+        assert a.streaming is not None
+        a.data_received("next\r", None)
+        await settle()
+        out = a._chan.output()
+        # the escape ends before the page goes out, the terminal just drops a half copy
+        assert out.index("\a") < out.index("chat log page 1")
+        assert a.streaming is None and a.held is None
+
+    asyncio.run(main())
+
+
+def test_pager_stays_in_bounds():
+    async def main():
+        a, b = await pair()
+        chatter(a, b, 300)
+        a.data_received("save\r", None)
+        await settle(50)
+        total = len(a.messages)
+
+        async def page(command):
+            a._chan.written.clear()
+            a.data_received(command + "\r", None)
+            await settle()
+            return tuple(int(n) for n in PAGE.findall(a._chan.output())[-1])
+
+        # the first next or prev opens page 1, prev from there stays put
+        pages = [await page("prev")]
+        assert pages[0][:2] == (1, 1) and pages[0][3] == total
+        assert await page("prev") == pages[0]
+        while pages[-1][2] < total:
+            pages.append(await page("next"))
+            # each page starts right after the last one ended
+            assert pages[-1][1] == pages[-2][2] + 1
+        assert await page("next") == pages[-1]
+        assert pages[-1][0] == len(pages) > 1
+        for _ in range(len(pages) + 3):
+            last = await page("prev")
+        assert last == pages[0]
+
+    asyncio.run(main())
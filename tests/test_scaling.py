@@ -0,0 +1,25 @@
+import socket
+
+import termegle_loadtest
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_workers_scaling_run(tmp_path):
+    # the real thing: the server started with --workers 1, 2 and 4 and the load test thrown at each.
+    # prints messages/s per worker count. it only goes up with the cores to run on, so the check here
+    # is just that chat gets through every way it's started
+    results = termegle_loadtest.main([
+        "--scaling", "1,2,4", "--port", str(free_port()), "--users", "40", "--rate", "2",
+        "--ramp", "1", "--duration", "3", "--idle-fraction", "0", "--timeout", "10",
+        "--out", str(tmp_path / "scaling.json"),
+    ])
+    print(f"\n{results['cpus']} cpu(s):")
+    for run in results["runs"]:
+        print(f"  {run['workers']} workers: {run['messages_per_second']} messages/s, server cpu {run['server_cpu_seconds']}s")
+        assert run["messages_received"] > 0
+        assert not run["errors"]
@@ -0,0 +1,88 @@
+import asyncio
+import random
+import time
+
+import termegle_server as ts
+
+# the simulation runs on a shrunk clock, a real second of waiting is a hundredth of one here
+PATIENCE = 0.05
+SLO = 0.3
+USERS = 400
+ARRIVALS = 400  # per second
+TOPICS = [f"topic {n}" for n in range(150)]
+
+
+def uniform(rng):
+    return set(rng.sample(TOPICS[:50], rng.randint(0, 3)))
+
+
+ZIPF = [1 / (n + 1) ** 1.5 for n in range(len(TOPICS))]
+
+
+def zipf(rng):
+    return set(rng.choices(TOPICS, ZIPF, k=rng.randint(0, 3)))
+
+
+def one_hot_topic(rng):
+    # most people typed the same thing, everyone else has something nobody shares
+    if rng.random() < 0.8:
+        return {"music"}
+    return {rng.choice(TOPICS)}
+
+
+class User:
+    def __init__(self, waits):
+        self.waits = waits
+        self.partner = None
+        self.since = time.monotonic()
+        self.updates = 0
+
+    def paired(self, partner, common, joined=False):
+        self.partner = partner
+        self.waits.append(time.monotonic() - self.since)
+
+    def peer_left(self, partner, reason=None):
+        #back in the queue
+        self.partner = None
+        self.since = time.monotonic()
+
+    def queue_status(self, position, estimate):
+        self.updates += 1
+
+
+async def simulate(interests, seed):
+    rng = random.Random(seed)
+    mm = ts.Matchmaker(PATIENCE, SLO)
+    waits = []
+    users = []
+
+    async def visit():
+        user = User(waits)
+        users.append(user)
+        mm.add_user(user)
+        mm.join(user, interests(rng))
+        await asyncio.sleep(rng.expovariate(1 / 0.3))
+        mm.leave(user)
+
+    visits = []
+    for _ in range(USERS):
+        visits.append(asyncio.create_task(visit()))
+        await asyncio.sleep(rng.expovariate(ARRIVALS))
+    await asyncio.gather(*visits)
+    mm.task.cancel()
+    return sorted(waits), sum(user.updates for user in users)
+
+
+def test_waits_under_skewed_interests(monkeypatch):
+    monkeypatch.setattr(ts, "QUEUE_STATUS_INTERVAL", 0.05)
+    print()
+    for seed, interests in enumerate((uniform, zipf, one_hot_topic)):
+        waits, updates = asyncio.run(simulate(interests, seed))
+        p50 = waits[len(waits) // 2]
+        p99 = waits[int(len(waits) * 0.99)]
+        print(f"{interests.__name__:>14}: {len(waits)} matches, wait p50 {p50 * 1000:.0f}ms "
+              f"p99 {p99 * 1000:.0f}ms max {waits[-1] * 1000:.0f}ms, {updates} queue updates")
+        # hardly anyone holds out much past their patience, and the slo catches whoever's left
+        # with the next person through the door
+        assert p99 < PATIENCE * 3
+        assert waits[-1] < SLO + 0.05